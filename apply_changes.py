@@ -1,5 +1,84 @@
+import ast
+import functools
+import logging
+import re
+from typing import List, Optional, Tuple, Union
+
 from models import ModelEdit
 
+logger = logging.getLogger(__name__)
+
+
+# What may precede `def` on a definition line: indentation and an optional `async`
+_DEF_PREFIX_RE = re.compile(r"([ \t]*)(?:async[ \t]+)?")
+
+
+@functools.lru_cache(maxsize=512)
+def _def_re(function_name: str) -> "re.Pattern[str]":
+    """
+    Compiled matcher for `def name(` anywhere in the text.
+
+    The pattern starts with a literal, which lets the regex engine use its
+    fast substring search instead of attempting a match at every line start.
+    The literal `(` after the name acts as a word boundary, so `process` does
+    not match `def process_data(`. Callers check the line prefix separately
+    with _DEF_PREFIX_RE.
+    """
+    return re.compile(rf"def {re.escape(function_name)}\s*\(")
+
+
+@functools.lru_cache(maxsize=64)
+def _dedent_re(base_indent: int) -> "re.Pattern[str]":
+    """
+    Compiled matcher for the newline that ends a block indented at `base_indent`.
+
+    Matches a newline followed by a non-empty line whose leading whitespace is
+    at most `base_indent` characters wide. Whitespace-only lines never match.
+    """
+    return re.compile(rf"\n(?=[^\S\n]{{0,{base_indent}}}\S)")
+
+
+# Sized to hold a whole dataset, so later code models in a sweep (and reruns
+# in the same process) reuse every location found by the first one
+@functools.lru_cache(maxsize=4096)
+def _locate_function(text: str, function_name: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Locate `function_name`'s block as (def_offset, body_end_offset, base_indent).
+
+    The block is text[def_offset:body_end_offset]. Results are memoized per
+    (text, function_name), so extracting and then applying against the same
+    file scans it only once.
+
+    Logic:
+    1. Finds the first line that starts with `def {function_name}(` (or the
+       async variant), ignoring leading indentation.
+    2. Scans forward until a non-empty line with indentation less than or equal
+       to the function's base indentation, or end of file.
+
+    Both steps are single regex searches over `text`, so no per-line work
+    happens in Python.
+    Returns None if the function is not found.
+    """
+    # Search the raw text for the literal def, then accept the first hit whose
+    # line contains nothing but indentation (and optionally `async`) before it.
+    for match in _def_re(function_name).finditer(text):
+        line_start = text.rfind("\n", 0, match.start()) + 1
+        prefix = _DEF_PREFIX_RE.fullmatch(text, line_start, match.start())
+        if prefix is not None:
+            break
+    else:
+        return None
+    base_indent = len(prefix.group(1))
+
+    # Find function end
+    # "Scan forward until: A non-empty line with indentation less than or equal to the function’s base indentation, or End of file."
+    # Empty lines (whitespace only) don't terminate the block; only the next non-empty line decides.
+    end = _dedent_re(base_indent).search(text, match.end())
+    if end is None:
+        return line_start, len(text), base_indent
+    return line_start, end.start() + 1, base_indent
+
+
 def apply_replace_function(original_file: str, edit: ModelEdit) -> str:
     """
     Naively replace the implementation of a single function in a Python file.
@@ -16,48 +95,12 @@ def apply_replace_function(original_file: str, edit: ModelEdit) -> str:
     Returns:
         The modified file content.
     """
-    lines = original_file.splitlines(keepends=True) # Keep newlines to preserve file structure exactly
-    n = len(lines)
-
-    # Find function start
-    start_idx = None
-    file_indent = None 
-    
-    # We search for "def function_name(" or "async def function_name("
-    target_def = f"def {edit.function_name}("
-    target_async_def = f"async def {edit.function_name}("
-    
-    for i, line in enumerate(lines):
-        # Naive check: does stripped line start with the def?
-        # This might match "def my_func_helper" if looking for "def my_func", so be careful.
-        # Ideally we check for word boundary, but sticking to requested simple logic:
-        # "Locate the function definition line: a line whose stripped text starts with def {function_name}(."
-        stripped = line.lstrip()
-        if stripped.startswith(target_def) or stripped.startswith(target_async_def):
-            start_idx = i
-            base_indent = len(line) - len(stripped)
-            break
-
-    if start_idx is None:
+    location = _locate_function(original_file, edit.function_name)
+    if location is None:
         # Function not found; return original.
-        print(f"Warning: Function '{edit.function_name}' not found in file.")
+        logger.warning("Warning: Function '%s' not found in file.", edit.function_name)
         return original_file
-
-    # Find function end
-    # "Scan forward until: A non-empty line with indentation less than or equal to the function’s base indentation, or End of file."
-    end_idx = start_idx + 1
-    while end_idx < n:
-        line = lines[end_idx]
-        stripped = line.strip()
-        
-        # Empty lines (whitespace only) are considered part of the function (or at least don't terminate it)
-        # unless followed by a dedent. 
-        # Standard python parsing relies on the next non-empty line.
-        if stripped: # If line is not empty
-            current_indent = len(line) - len(line.lstrip())
-            if current_indent <= base_indent:
-                break
-        end_idx += 1
+    start, end, _ = location
 
     # Prepare new lines
     # edit.new_function_code comes as a string, potentially without matching indentation of the file context if extracted poorly,
@@ -71,16 +114,11 @@ def apply_replace_function(original_file: str, edit: ModelEdit) -> str:
     if not new_code.endswith('\n'):
         new_code += '\n'
         
-    # Construct result
-    # lines[:start_idx] includes everything before the def
+    # Construct result by slicing the original around the block:
+    # original_file[:start] is everything before the def
     # new_code is the replacement
-    # lines[end_idx:] is everything after
-    
-    # helper to join list of strings
-    prefix = "".join(lines[:start_idx])
-    suffix = "".join(lines[end_idx:])
-    
-    return prefix + new_code + suffix
+    # original_file[end:] is everything after
+    return original_file[:start] + new_code + original_file[end:]
 
 
 def extract_function_block(file_content: str, function_name: str) -> str:
@@ -90,33 +128,85 @@ def extract_function_block(file_content: str, function_name: str) -> str:
     
     Returns empty string if not found.
     """
-    lines = file_content.splitlines(keepends=True)
-    n = len(lines)
-    
-    target_def = f"def {function_name}("
-    target_async_def = f"async def {function_name}("
-    
-    start_idx = None
-    base_indent = 0
-    
-    for i, line in enumerate(lines):
-        stripped = line.lstrip()
-        if stripped.startswith(target_def) or stripped.startswith(target_async_def):
-            start_idx = i
-            base_indent = len(line) - len(stripped)
-            break
-            
-    if start_idx is None:
+    location = _locate_function(file_content, function_name)
+    if location is None:
         return ""
-        
-    end_idx = start_idx + 1
-    while end_idx < n:
-        line = lines[end_idx]
-        stripped = line.strip()
-        if stripped:
-            current_indent = len(line) - len(line.lstrip())
-            if current_indent <= base_indent:
-                break
-        end_idx += 1
-        
-    return "".join(lines[start_idx:end_idx])
+    start, end, _ = location
+
+    return file_content[start:end]
+
+
+@functools.lru_cache(maxsize=32)
+def _cached_parse(source: str) -> ast.Module:
+    """Parse `source` once; repeated applies against the same file reuse the tree."""
+    return ast.parse(source)
+
+
+def _line_starts(text: str) -> List[int]:
+    """Offsets of the first character of every line in `text`."""
+    starts = [0]
+    find = text.find
+    pos = find("\n")
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = find("\n", pos + 1)
+    return starts
+
+
+def _find_function_node(
+    body: List[ast.stmt], function_name: str
+) -> Optional[Union[ast.FunctionDef, ast.AsyncFunctionDef]]:
+    """Depth-first search for a module- or class-level function definition."""
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == function_name:
+            return node
+        if isinstance(node, ast.ClassDef):
+            found = _find_function_node(node.body, function_name)
+            if found is not None:
+                return found
+    return None
+
+
+def apply_replace_function_ast(original_file: str, edit: ModelEdit) -> str:
+    """
+    Replace a function using the parsed AST to find its exact line range.
+
+    Unlike apply_replace_function, the replaced range starts at the first
+    decorator and ends at the function's last line, so decorators are swapped
+    along with the body and trailing blank lines are kept. Falls back to the
+    naive mechanism if the original file does not parse.
+
+    Args:
+        original_file: The full content of the file.
+        edit: The ModelEdit object containing the function name and new code.
+
+    Returns:
+        The modified file content.
+    """
+    try:
+        tree = _cached_parse(original_file)
+    except SyntaxError:
+        return apply_replace_function(original_file, edit)
+
+    node = _find_function_node(tree.body, edit.function_name)
+    if node is None:
+        logger.warning("Warning: Function '%s' not found in file.", edit.function_name)
+        return original_file
+
+    first_line = node.decorator_list[0].lineno if node.decorator_list else node.lineno
+    starts = _line_starts(original_file)
+    start = starts[first_line - 1]
+    end = starts[node.end_lineno] if node.end_lineno < len(starts) else len(original_file)
+
+    new_code = edit.new_function_code
+    if not new_code.endswith('\n'):
+        new_code += '\n'
+
+    return original_file[:start] + new_code + original_file[end:]
+
+
+# Apply mechanisms by name, as chosen with --apply-mode
+APPLY_MODES = {
+    "naive": apply_replace_function,
+    "ast": apply_replace_function_ast,
+}
@@ -1,4 +1,5 @@
 from typing import List
+import functools
 import os
 
 try:
@@ -21,21 +22,40 @@ class Settings(BaseSettings):
     openrouter_base_url: str = "https://openrouter.ai/api/v1"
 
     code_model_default: str = "google/gemini-2.0-flash-001"
+    code_model_temperature: float = 0.2  # Set to 0 to make generations deterministic and cacheable
     # Judge models as a comma-separated string in env, parsed to list here if needed, 
     # but BaseSettings handles List[str] if env is formatted right (json) or if we parse manual.
     # For simplicity with .env files, we'll take a string and parse it in a validator or post-init,
     # or just keep it simple and expect comma-separated string in env and handle parsing manually if pydantic fails.
     # To be safe and simple: use str and property or standard list parsing.
     judge_models_str: str = "google/gemini-2.0-flash-001" 
+    judge_concurrency: int = 8  # Max judge calls in flight for batched judging
+    judge_stream: bool = False  # Stream judge responses and parse as soon as the JSON is complete
+    # Originals longer than this are sent to the judge as changed regions only (0 = always full files)
+    judge_inline_threshold_chars: int = 20000
     
     llm_temperature: float = 0.0
     llm_max_tokens: int = 1024
     llm_top_p: float = 1.0
     llm_frequency_penalty: float = 0.0
     llm_presence_penalty: float = 0.0
+    llm_concurrency: int = 8  # Max in-flight requests for batched generation
+    llm_max_in_flight: int = 32  # Max sync requests in flight across all threads
+    llm_max_retries: int = 4  # Retries on timeouts, connection errors, 429 and 5xx
+    llm_retry_max_wait: float = 30.0  # Cap (seconds) for backoff and Retry-After
+    llm_gzip_requests: bool = False  # gzip request bodies over 1 KB (endpoint must accept it)
+    llm_prompt_cache_hints: bool = False  # Mark shared prompt prefixes (original file) with cache_control; opt in per provider
 
-    @property
+    # Exact-match cache for temperature-0 responses (see llm_cache.py)
+    llm_cache_enabled: bool = True
+    llm_cache_dir: str = ".cache/llm"
+    llm_cache_refresh: bool = False  # Ignore cached responses but store fresh ones
+
+    verbose: bool = False
+
+    @functools.cached_property
     def judge_models(self) -> List[str]:
+        # Parsed once per Settings instance; the string is not mutated after load
         if not self.judge_models_str:
             return []
         return [m.strip() for m in self.judge_models_str.split(",") if m.strip()]
@@ -46,11 +66,37 @@ class Settings(BaseSettings):
         case_sensitive = False
         extra = "ignore" # Ignore extra env vars
 
-# Try to load from .env using python-dotenv if available, as pydantic[dotenv] might not be there
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass
 
-settings = Settings()
+@functools.lru_cache(maxsize=None)
+def load_env() -> None:
+    """
+    Load .env into os.environ, once.
+
+    Called by get_settings and by modules that read environment variables
+    directly (tracing.py), so values kept only in .env are seen either way.
+    """
+    # Try to load from .env using python-dotenv if available, as pydantic[dotenv] might not be there
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    Build the settings on first use and return the same instance afterwards.
+
+    Loading .env and instantiating Settings is deferred until a caller actually
+    needs configuration, so importing modules that never touch it stays cheap.
+    """
+    load_env()
+    return Settings()
+
+
+def __getattr__(name: str):
+    # Backwards compatibility for `from config import settings`
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
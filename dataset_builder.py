@@ -11,12 +11,30 @@ Key Design Principles:
 4. expected_success indicates whether we expect the apply to work
 """
 
-from typing import List
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
 from models import DatasetExample, DifficultyLevel
 
 
-def get_dataset() -> List[DatasetExample]:
-    """Return the list of evaluation examples with varying difficulty levels."""
+# Built once on first access; the examples are static fixtures.
+_DATASET_CACHE: Optional[List[DatasetExample]] = None
+
+# Indexes over the cached dataset, populated alongside it. Tag membership and
+# expected success are bitsets: bit i is set when examples[i] qualifies.
+_BY_DIFFICULTY: Dict[DifficultyLevel, List[DatasetExample]] = {}
+_TAG_MASKS: Dict[str, int] = {}
+_SUCCESS_MASK: int = 0
+
+
+# The examples below are hand-written, trusted literals, so they are built
+# without running pydantic validation (checked once in the test suite instead).
+_example = DatasetExample.model_construct
+
+
+def _build_dataset() -> List[DatasetExample]:
+    """Construct the list of evaluation examples with varying difficulty levels."""
     examples = []
 
     # =========================================================================
@@ -24,7 +42,7 @@ def get_dataset() -> List[DatasetExample]:
     # These should all succeed - baseline for the apply mechanism
     # =========================================================================
 
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=1,
         original_file="""def foo(x):
     return x + 1
@@ -42,7 +60,7 @@ def get_dataset() -> List[DatasetExample]:
         tags=["simple", "return-value-change"]
     ))
 
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=2,
         original_file="""def check_positive(n):
     if n > 0:
@@ -72,7 +90,7 @@ def get_dataset() -> List[DatasetExample]:
     # =========================================================================
 
     # Example 3: Model output has trailing whitespace
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=3,
         original_file="""def calculate_area(radius):
     pi = 3.14
@@ -94,7 +112,7 @@ def get_dataset() -> List[DatasetExample]:
     ))
 
     # Example 4: Model output missing final newline
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=4,
         original_file="""def process_data(data):
     result = []
@@ -123,7 +141,7 @@ def get_dataset() -> List[DatasetExample]:
     ))
 
     # Example 5: Model output has extra blank lines
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=5,
         original_file="""def cleanup(text):
     text = text.strip()
@@ -156,7 +174,7 @@ def get_dataset() -> List[DatasetExample]:
     # =========================================================================
 
     # Example 6: Wrong indentation (tabs vs spaces)
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=6,
         original_file="""def sum_evens(nums):
     total = 0
@@ -180,7 +198,7 @@ def get_dataset() -> List[DatasetExample]:
     ))
 
     # Example 7: Model output has wrong base indentation (not at column 0)
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=7,
         original_file="""def is_valid_email(email):
     return "@" in email
@@ -200,7 +218,7 @@ def get_dataset() -> List[DatasetExample]:
     ))
 
     # Example 8: Multi-function file - must not affect other functions
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=8,
         original_file="""def helper():
     return 42
@@ -234,7 +252,7 @@ def farewell(name):
     ))
 
     # Example 9: Function with decorator
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=9,
         original_file="""import functools
 
@@ -267,7 +285,7 @@ def fibonacci(n):
     ))
 
     # Example 10: Nested function - edit the outer function
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=10,
         original_file="""def outer(x):
     def inner(y):
@@ -296,7 +314,7 @@ def fibonacci(n):
     # =========================================================================
 
     # Example 11: Function name appears in string/comment
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=11,
         original_file="""# This module contains calculate_tax function
 def calculate_tax(p):
@@ -323,7 +341,7 @@ def calculate_tax(price):
     ))
 
     # Example 12: Similar function names
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=12,
         original_file="""def process():
     return "base"
@@ -355,7 +373,7 @@ def process_data_async():
     ))
 
     # Example 13: Function not found (model hallucinates wrong name)
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=13,
         original_file="""def validate_input(data):
     return data is not None
@@ -375,7 +393,7 @@ def process_data_async():
     ))
 
     # Example 14: Syntax error in model output
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=14,
         original_file="""def divide(a, b):
     return a / b
@@ -399,7 +417,7 @@ def process_data_async():
     ))
 
     # Example 15: Class method (not standalone function)
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=15,
         original_file="""class Calculator:
     def __init__(self):
@@ -440,7 +458,7 @@ def process_data_async():
     ))
 
     # Example 16: Empty function body
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=16,
         original_file="""def placeholder():
     pass
@@ -459,7 +477,7 @@ def process_data_async():
     ))
 
     # Example 17: Function with type hints
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=17,
         original_file="""from typing import List, Optional
 
@@ -488,7 +506,7 @@ def find_max(numbers: List[int], default: int = 0) -> int:
     ))
 
     # Example 18: Async function
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=18,
         original_file="""import asyncio
 
@@ -514,7 +532,7 @@ async def fetch_data(url, timeout=30):
     ))
 
     # Example 19: Long function with many lines
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=19,
         original_file="""def complex_calculation(data):
     # Step 1: Validate
@@ -602,7 +620,7 @@ async def fetch_data(url, timeout=30):
     ))
 
     # Example 20: Partial code from model (incomplete function)
-    examples.append(DatasetExample(
+    examples.append(_example(
         id=20,
         original_file="""def merge_dicts(dict1, dict2):
     result = dict1.copy()
@@ -640,51 +658,124 @@ async def fetch_data(url, timeout=30):
     return examples
 
 
+def _share_strings(examples: List[DatasetExample]) -> None:
+    """
+    Make repeated strings across examples share a single object.
+
+    Tags are interned; identical file/code blobs (many examples reuse the same
+    original or target text) are collapsed to one instance.
+    """
+    seen: Dict[str, str] = {}
+    for ex in examples:
+        ex.tags[:] = [sys.intern(tag) for tag in ex.tags]
+        ex.original_file = seen.setdefault(ex.original_file, ex.original_file)
+        ex.target_file = seen.setdefault(ex.target_file, ex.target_file)
+        if ex.model_output is not None:
+            ex.model_output = seen.setdefault(ex.model_output, ex.model_output)
+
+
+def _cached_dataset() -> List[DatasetExample]:
+    """Return the shared, memoized example list (do not mutate)."""
+    global _DATASET_CACHE
+    if _DATASET_CACHE is None:
+        examples = _build_dataset()
+        _share_strings(examples)
+        _build_indexes(examples)
+        _DATASET_CACHE = examples
+    return _DATASET_CACHE
+
+
+def _build_indexes(examples: List[DatasetExample]) -> None:
+    """Populate the difficulty list index and the tag/success bitsets in one pass."""
+    global _SUCCESS_MASK
+    by_difficulty = defaultdict(list)
+    tag_masks = defaultdict(int)
+    success_mask = 0
+    for i, ex in enumerate(examples):
+        bit = 1 << i
+        by_difficulty[ex.difficulty].append(ex)
+        for tag in ex.tags:
+            tag_masks[tag] |= bit
+        if ex.expected_success:
+            success_mask |= bit
+    _BY_DIFFICULTY.clear()
+    _BY_DIFFICULTY.update(by_difficulty)
+    _TAG_MASKS.clear()
+    _TAG_MASKS.update(tag_masks)
+    _SUCCESS_MASK = success_mask
+
+
+def _mask_to_list(mask: int) -> List[DatasetExample]:
+    """Return the examples whose bits are set in `mask`, in dataset order."""
+    examples = _cached_dataset()
+    selected = []
+    while mask:
+        low = mask & -mask
+        selected.append(examples[low.bit_length() - 1])
+        mask ^= low
+    return selected
+
+
+def get_dataset() -> List[DatasetExample]:
+    """Return the list of evaluation examples with varying difficulty levels."""
+    # Shallow copy so callers can reorder/slice without affecting the cache
+    return list(_cached_dataset())
+
+
 def get_dataset_by_difficulty(difficulty: DifficultyLevel) -> List[DatasetExample]:
     """Filter dataset by difficulty level."""
-    return [ex for ex in get_dataset() if ex.difficulty == difficulty]
+    _cached_dataset()
+    return list(_BY_DIFFICULTY.get(difficulty, ()))
 
 
 def get_dataset_by_tags(tags: List[str]) -> List[DatasetExample]:
     """Filter dataset by tags (returns examples that have ANY of the specified tags)."""
-    return [ex for ex in get_dataset() if any(t in ex.tags for t in tags)]
+    _cached_dataset()
+    mask = 0
+    for tag in tags:
+        mask |= _TAG_MASKS.get(tag, 0)
+    return _mask_to_list(mask)
 
 
 def get_expected_failures() -> List[DatasetExample]:
     """Get examples where we expect the apply mechanism to fail."""
-    return [ex for ex in get_dataset() if not ex.expected_success]
+    all_examples = (1 << len(_cached_dataset())) - 1
+    return _mask_to_list(~_SUCCESS_MASK & all_examples)
 
 
 def export_to_jsonl(path: str) -> None:
     """Export the dataset to a JSONL file at the given path."""
-    import json
-    examples = get_dataset()
-    with open(path, 'w', encoding='utf-8') as f:
-        for ex in examples:
-            f.write(ex.model_dump_json() + '\n')
+    # Build the whole payload and write it in one call
+    payload = "".join(ex.model_dump_json() + "\n" for ex in _cached_dataset())
+    with open(path, 'wb') as f:
+        f.write(payload.encode('utf-8'))
 
 
 def print_dataset_summary() -> None:
     """Print a summary of the dataset."""
-    examples = get_dataset()
+    examples = _cached_dataset()
+
+    # Tally everything in a single pass over the examples
+    diff_counts = Counter()
+    tag_counts = Counter()
+    success = 0
+    for ex in examples:
+        diff_counts[ex.difficulty] += 1
+        tag_counts.update(ex.tags)
+        success += ex.expected_success
+    failure = len(examples) - success
+
     print(f"Total examples: {len(examples)}")
     print("\nBy difficulty:")
     for diff in DifficultyLevel:
-        count = len([e for e in examples if e.difficulty == diff])
-        print(f"  {diff.value}: {count}")
+        print(f"  {diff.value}: {diff_counts[diff]}")
     
     print("\nExpected outcomes:")
-    success = len([e for e in examples if e.expected_success])
-    failure = len([e for e in examples if not e.expected_success])
     print(f"  Expected success: {success}")
     print(f"  Expected failure: {failure}")
     
     print("\nTags distribution:")
-    all_tags = {}
-    for ex in examples:
-        for tag in ex.tags:
-            all_tags[tag] = all_tags.get(tag, 0) + 1
-    for tag, count in sorted(all_tags.items(), key=lambda x: -x[1]):
+    for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
         print(f"  {tag}: {count}")
 
 
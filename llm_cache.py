@@ -0,0 +1,69 @@
+"""
+Exact-match response cache for deterministic LLM calls.
+
+A request is keyed by the SHA-256 of its canonicalized JSON body (model,
+messages, sampling parameters, response format). Only temperature-0 requests
+are cached, since those are expected to return the same output every time.
+Entries are stored as one JSON file per key, so the cache survives reruns and
+can be shared safely between threads and processes.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from config import get_settings
+
+# Hit/miss counters for the current process
+stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def cache_key(request_body: Dict[str, Any]) -> Optional[str]:
+    """
+    Return the cache key for a chat completions request body.
+
+    Returns None for sampled (temperature > 0) requests, which must not be cached.
+    """
+    if request_body.get("temperature", 0.0) > 0:
+        return None
+    canonical = json.dumps(request_body, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _cache_path(key: str) -> Path:
+    return Path(get_settings().llm_cache_dir) / f"{key}.json"
+
+
+def _count(field: str) -> None:
+    with _stats_lock:
+        stats[field] += 1
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    """Return the cached response for `key`, or None on a miss."""
+    try:
+        with open(_cache_path(key), "r", encoding="utf-8") as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        _count("misses")
+        return None
+    _count("hits")
+    return value
+
+
+def put(key: str, response: Dict[str, Any]) -> None:
+    """Store `response` under `key`. Failures to write are ignored."""
+    path = _cache_path(key)
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(response, f)
+        # Atomic swap so concurrent readers never see a partial entry
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
@@ -1,13 +1,154 @@
 
+import asyncio
+import functools
+import gzip
 import json
+import random
+import re
+import threading
+import time
 import requests
-from typing import Optional, Dict, Any, List
-from config import settings
+from requests.adapters import HTTPAdapter
+from typing import Optional, Dict, Any, List, Tuple, Union
+from pydantic import ValidationError
+from config import get_settings
+from models import ChatCompletionResponse
+import llm_cache
 import logging
 
+# httpx is optional; without it the batch helpers fall back to sequential calls
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# h2 enables HTTP/2 on the async client (many concurrent requests, one connection)
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+# orjson is optional; it is several times faster than json on large prompts
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
+def _json_dumps(obj: Any) -> bytes:
+    """Serialize a request body to UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _json_loads(data: Any) -> Any:
+    """Parse JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Request bodies smaller than this are not worth compressing
+_GZIP_MIN_BYTES = 1024
+
+
+def _encode_body(data: Dict[str, Any], settings) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Serialize a request body, gzip-compressing it when enabled and large enough.
+
+    Returns (body, extra_headers). Prompts embed whole source files, so they
+    compress well; compression is opt-in via `settings.llm_gzip_requests`
+    because not every OpenAI-compatible endpoint accepts encoded bodies.
+    """
+    body = _json_dumps(data)
+    if settings.llm_gzip_requests and len(body) > _GZIP_MIN_BYTES:
+        return gzip.compress(body, compresslevel=5), {"Content-Encoding": "gzip"}
+    return body, {}
+
+
+# A markdown code fence wrapping the whole response (```, ```python, ```json, ...).
+# The opening fence may be followed by a newline or, for single-line replies
+# such as ```json{"a": 1}```, directly by content; a tag is only taken from a
+# single-line fence when it is python/json followed by whitespace, `{` or `[`,
+# so ```x = 1``` keeps its `x` and ```pythonic = 1``` keeps its `python`.
+_FENCE_RE = re.compile(r"\A\s*```(?:[\w+-]*[ \t]*\n|(?:(?:python|json)(?=[\s{\[]))?[ \t]*)|\n?[ \t]*```\s*\Z")
+
+
+def _strip_fences(content: str) -> str:
+    """
+    Remove markdown fences around a model response (models love adding them).
+
+    Only a fence opening the response and one closing it are removed, in a
+    single regex pass. Leading indentation of the first line is kept, so an
+    indented method survives intact.
+    """
+    return _FENCE_RE.sub("", content).rstrip().lstrip("\r\n")
+
+
+def _is_cacheable(result: Any) -> bool:
+    """
+    Whether a 2xx response body is worth caching.
+
+    Error payloads, malformed bodies and empty completions are not, so a
+    transient bad reply is retried on the next run instead of replayed.
+    """
+    try:
+        content = ChatCompletionResponse.model_validate(result).content
+    except ValidationError:
+        return False
+    return bool(content.strip())
+
+
+# Transient statuses worth retrying; anything else fails immediately
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def _retry_delay(attempt: int, retry_after: Optional[str], max_wait: float) -> float:
+    """
+    Seconds to sleep before retry number `attempt` (0-based).
+
+    Honors a numeric Retry-After header when the server sends one; otherwise
+    uses exponential backoff (1s, 2s, 4s, ...) plus up to 1s of random jitter
+    so concurrent workers don't retry in lockstep.
+    """
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), max_wait)
+        except ValueError:
+            pass  # HTTP-date form; fall back to backoff
+    return min(2.0 ** attempt, max_wait) + random.uniform(0, 1)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_session() -> requests.Session:
+    """
+    Shared session for all sync OpenRouter calls.
+
+    Keeps connections alive between calls (no new TCP/TLS handshake per
+    request) and carries the static headers so they are not rebuilt each time.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(LLMClient._headers(get_settings()))
+    return session
+
+
+@functools.lru_cache(maxsize=None)
+def _request_slots() -> threading.BoundedSemaphore:
+    """
+    Process-wide cap on sync requests in flight (`settings.llm_max_in_flight`).
+
+    Examples, code models and judges each fan out on their own thread pools;
+    this bounds their product so a large run stays under the API rate limit.
+    """
+    return threading.BoundedSemaphore(max(1, get_settings().llm_max_in_flight))
+
 class LLMClient:
     """
     Client for interacting with LLMs via OpenRouter.
@@ -29,13 +170,250 @@ class LLMClient:
         """
         Call OpenRouter chat completions API.
         """
-        headers = {
+        settings = get_settings()
+        data = LLMClient._payload(
+            model, messages, temperature, max_tokens, top_p,
+            frequency_penalty, presence_penalty, response_format
+        )
+        url = f"{LLMClient.BASE_URL}/chat/completions"
+        
+        cache_key = llm_cache.cache_key(data) if settings.llm_cache_enabled else None
+        if cache_key and not settings.llm_cache_refresh:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if settings.verbose:
+            print(f"Calling OpenRouter model={model}")
+            
+        try:
+            response = LLMClient._post_with_retries(url, data, settings)
+            response.raise_for_status()
+            result = _json_loads(response.content)
+            if cache_key and _is_cacheable(result):
+                llm_cache.put(cache_key, result)
+            return result
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 400:
+                print(f"LLM 400 Error: {e.response.text}")
+            raise e
+        except Exception as e:
+            print(f"Error calling LLM: {e}")
+            raise e
+
+    @staticmethod
+    async def acall_chat(
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.0,
+        max_tokens: int = 4000,
+        top_p: float = 1.0,
+        frequency_penalty: float = 0.0,
+        presence_penalty: float = 0.0,
+        response_format: Optional[Dict[str, str]] = None,
+        client: Optional["httpx.AsyncClient"] = None
+    ) -> Dict[str, Any]:
+        """
+        Async variant of call_chat using httpx.
+
+        Pass a shared `client` to reuse connections across concurrent calls;
+        otherwise a short-lived client is created for this request.
+        """
+        if httpx is None:
+            raise ImportError("httpx is required for async LLM calls (pip install httpx)")
+
+        if client is None:
+            async with _new_async_client(1) as own_client:
+                return await LLMClient.acall_chat(
+                    model, messages, temperature, max_tokens, top_p,
+                    frequency_penalty, presence_penalty, response_format,
+                    client=own_client
+                )
+
+        settings = get_settings()
+        headers = LLMClient._headers(settings)
+        data = LLMClient._payload(
+            model, messages, temperature, max_tokens, top_p,
+            frequency_penalty, presence_penalty, response_format
+        )
+        url = f"{LLMClient.BASE_URL}/chat/completions"
+
+        cache_key = llm_cache.cache_key(data) if settings.llm_cache_enabled else None
+        if cache_key and not settings.llm_cache_refresh:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if settings.verbose:
+            print(f"Calling OpenRouter model={model} (async)")
+
+        try:
+            response = await LLMClient._apost_with_retries(client, url, headers, data, settings)
+            response.raise_for_status()
+            result = _json_loads(response.content)
+            if cache_key and _is_cacheable(result):
+                llm_cache.put(cache_key, result)
+            return result
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 400:
+                print(f"LLM 400 Error: {e.response.text}")
+            raise e
+        except Exception as e:
+            print(f"Error calling LLM: {e}")
+            raise e
+
+    @staticmethod
+    def stream_chat(
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.0,
+        max_tokens: int = 4000,
+        top_p: float = 1.0,
+        frequency_penalty: float = 0.0,
+        presence_penalty: float = 0.0,
+        response_format: Optional[Dict[str, str]] = None
+    ) -> str:
+        """
+        Call chat completions with `stream: true` and return the message content.
+
+        Server-sent events are consumed as they arrive. When a JSON
+        response_format is requested, reading stops as soon as the accumulated
+        content parses as JSON instead of waiting for the end of the stream.
+        Streamed responses are not cached.
+        """
+        settings = get_settings()
+        data = LLMClient._payload(
+            model, messages, temperature, max_tokens, top_p,
+            frequency_penalty, presence_penalty, response_format
+        )
+        data["stream"] = True
+        url = f"{LLMClient.BASE_URL}/chat/completions"
+        want_json = bool(response_format) and response_format.get("type") == "json_object"
+
+        if settings.verbose:
+            print(f"Calling OpenRouter model={model} (stream)")
+
+        try:
+            response = LLMClient._post_with_retries(url, data, settings, stream=True)
+            with response:
+                response.raise_for_status()
+                parts: List[str] = []
+                for line in response.iter_lines():
+                    # Skip blank separators and SSE comments (keep-alives)
+                    if not line.startswith(b"data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == b"[DONE]":
+                        break
+                    chunk = _json_loads(payload)
+                    if "error" in chunk:
+                        raise RuntimeError(f"Stream error: {chunk['error']}")
+                    choices = chunk.get("choices")
+                    delta = choices[0].get("delta", {}).get("content") if choices else None
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    if want_json and delta.rstrip().endswith(("}", "`")):
+                        try:
+                            _json_loads(_strip_fences("".join(parts)))
+                            break
+                        except ValueError:
+                            pass  # Object not complete yet
+                return "".join(parts)
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 400:
+                print(f"LLM 400 Error: {e.response.text}")
+            raise e
+        except Exception as e:
+            print(f"Error calling LLM: {e}")
+            raise e
+
+    @staticmethod
+    def _post_with_retries(
+        url: str,
+        data: Dict[str, Any],
+        settings,
+        stream: bool = False
+    ) -> requests.Response:
+        """
+        POST `data` on the shared session, retrying transient failures.
+
+        Timeouts, connection errors and 429/5xx responses are retried up to
+        `settings.llm_max_retries` times with backoff. The last response is
+        returned as-is (the caller raises on its status); the last network
+        error is re-raised. With `stream=True` the body is left unread.
+        """
+        session = _get_session()
+        body, extra_headers = _encode_body(data, settings)
+        for attempt in range(settings.llm_max_retries + 1):
+            last_attempt = attempt == settings.llm_max_retries
+            try:
+                # (connect, read) timeouts
+                with _request_slots():
+                    response = session.post(url, data=body, headers=extra_headers, timeout=(5, 60), stream=stream)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if last_attempt:
+                    raise
+                delay = _retry_delay(attempt, None, settings.llm_retry_max_wait)
+                logger.warning("LLM request failed (%s); retrying in %.1fs", e, delay)
+            else:
+                if response.status_code not in _RETRY_STATUSES or last_attempt:
+                    return response
+                delay = _retry_delay(attempt, response.headers.get("Retry-After"), settings.llm_retry_max_wait)
+                logger.warning("LLM request returned %s; retrying in %.1fs", response.status_code, delay)
+                # Release the pooled connection before backing off
+                response.close()
+            time.sleep(delay)
+
+    @staticmethod
+    async def _apost_with_retries(
+        client: "httpx.AsyncClient",
+        url: str,
+        headers: Dict[str, str],
+        data: Dict[str, Any],
+        settings
+    ) -> "httpx.Response":
+        """Async variant of _post_with_retries for httpx."""
+        body, extra_headers = _encode_body(data, settings)
+        headers = {**headers, **extra_headers}
+        for attempt in range(settings.llm_max_retries + 1):
+            last_attempt = attempt == settings.llm_max_retries
+            try:
+                response = await client.post(url, headers=headers, content=body)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                if last_attempt:
+                    raise
+                delay = _retry_delay(attempt, None, settings.llm_retry_max_wait)
+                logger.warning("LLM request failed (%s); retrying in %.1fs", e, delay)
+            else:
+                if response.status_code not in _RETRY_STATUSES or last_attempt:
+                    return response
+                delay = _retry_delay(attempt, response.headers.get("Retry-After"), settings.llm_retry_max_wait)
+                logger.warning("LLM request returned %s; retrying in %.1fs", response.status_code, delay)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _headers(settings) -> Dict[str, str]:
+        """Request headers for OpenRouter."""
+        return {
             "Authorization": f"Bearer {settings.openrouter_api_key}",
             "HTTP-Referer": "https://antigravity.dev", # Optional
             "X-Title": "Antigravity Agent", # Optional
             "Content-Type": "application/json"
         }
-        
+
+    @staticmethod
+    def _payload(
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        top_p: float,
+        frequency_penalty: float,
+        presence_penalty: float,
+        response_format: Optional[Dict[str, str]]
+    ) -> Dict[str, Any]:
+        """Request body for the chat completions endpoint."""
         data = {
             "model": model,
             "messages": messages,
@@ -48,38 +426,28 @@ class LLMClient:
         
         if response_format:
             data["response_format"] = response_format
-        
-        url = f"{LLMClient.BASE_URL}/chat/completions"
-        
-        if settings.verbose:
-            print(f"Calling OpenRouter model={model}")
-            
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=60)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 400:
-                print(f"LLM 400 Error: {e.response.text}")
-            raise e
-        except Exception as e:
-            print(f"Error calling LLM: {e}")
-            raise e
+        return data
 
     @staticmethod
     def generate_json(
         model: str,
-        prompt: str,
-        temperature: float = 0.0
+        prompt: Union[str, List[Dict[str, Any]]],
+        temperature: float = 0.0,
+        stream: bool = False
     ) -> Dict[str, Any]:
         """
         Generate a JSON response from the LLM.
+
+        `prompt` is the user message content: a string or a list of content
+        parts (see prompt_with_cached_prefix). With `stream=True` the response is streamed and parsing starts as soon
+        as a complete JSON object has arrived (see stream_chat).
         """
+        settings = get_settings()
         messages = [{"role": "user", "content": prompt}]
         
         # Use config settings for defaults, but allow override via params if needed
         # (Using specific params here for consistency with original judges.py)
-        response = LLMClient.call_chat(
+        request = dict(
             model=model,
             messages=messages,
             temperature=temperature,
@@ -89,11 +457,12 @@ class LLMClient:
             presence_penalty=settings.llm_presence_penalty,
             response_format={"type": "json_object"}
         )
-        
-        content = response['choices'][0]['message']['content']
-        # Clean up potential markdown fences
-        clean_content = content.replace("```json", "").replace("```", "").strip()
-        return json.loads(clean_content)
+        if stream:
+            content = LLMClient.stream_chat(**request)
+        else:
+            response = LLMClient.call_chat(**request)
+            content = ChatCompletionResponse.model_validate(response).content
+        return _json_loads(_strip_fences(content))
 
     @staticmethod
     def generate_text(
@@ -114,18 +483,45 @@ class LLMClient:
             top_p=1.0
         )
         
-        return response['choices'][0]['message']['content']
+        return ChatCompletionResponse.model_validate(response).content
 
-def generate_model_output(
-    original_file: str,
-    user_prompt: str,
-    model_name: str
-) -> str:
+def _new_async_client(max_connections: int) -> "httpx.AsyncClient":
     """
-    Generate the 'model_output' (suggested code change) using an LLM.
-    
-    This simulates the 'Code Model' in the system.
+    Create an httpx client sized for `max_connections` concurrent requests.
+
+    Uses HTTP/2 when h2 is installed, so concurrent requests are multiplexed
+    over a single connection instead of one TLS handshake each.
     """
+    return httpx.AsyncClient(
+        http2=_HTTP2,
+        timeout=httpx.Timeout(60.0, connect=5.0),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        )
+    )
+
+
+def prompt_with_cached_prefix(prefix: str, suffix: str) -> Union[str, List[Dict[str, Any]]]:
+    """
+    Build user message content whose `prefix` is marked as cacheable.
+
+    With `settings.llm_prompt_cache_hints` on, returns two text parts with a
+    `cache_control` breakpoint after the prefix, which OpenRouter forwards to
+    providers with prompt caching (Anthropic, Gemini). It is off by default,
+    since some OpenAI-compatible endpoints reject list-form content or
+    unknown keys; the plain concatenated string is returned then.
+    """
+    if not get_settings().llm_prompt_cache_hints:
+        return prefix + suffix
+    return [
+        {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": suffix},
+    ]
+
+
+def _code_generation_messages(original_file: str, user_prompt: str) -> List[Dict[str, Any]]:
+    """Build the chat messages asking the code model for a change."""
     system_prompt = """You are a coding assistant. 
 Your task is to generate the code change based on the user's request.
 You must output ONLY the code block that should be applied. 
@@ -133,40 +529,114 @@ Do not include explanation, thinking, or markdown fences around the code unless
 Just raw python code.
 """
     
-    user_msg = f"""
+    # The original file leads the user message so it can be served from the
+    # provider's prompt cache when several requests target the same file.
+    file_block = f"""
 Original File:
 {original_file}
-
+"""
+    request_block = f"""
 Request: {user_prompt}
 
 Provide the code snippet that should replace the relevant part (or the whole file if needed) to satisfy the request. 
 The format should be a valid python function or code block that can be swapped in.
 """
     
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_msg}
+        {"role": "user", "content": prompt_with_cached_prefix(file_block, request_block)}
     ]
+
+
+def generate_model_output(
+    original_file: str,
+    user_prompt: str,
+    model_name: str
+) -> str:
+    """
+    Generate the 'model_output' (suggested code change) using an LLM.
     
+    This simulates the 'Code Model' in the system.
+    """
     try:
         response = LLMClient.call_chat(
             model=model_name,
-            messages=messages,
-            temperature=0.2, # Low temp for code
+            messages=_code_generation_messages(original_file, user_prompt),
+            temperature=get_settings().code_model_temperature, # Low temp for code
             max_tokens=2000
         )
-        content = response['choices'][0]['message']['content']
-        
-        # Remove markdown fences if present (models love adding them)
-        if content.startswith("```python"):
-            content = content[len("```python"):].strip()
-        elif content.startswith("```"):
-            content = content[len("```"):].strip()
-        
-        if content.endswith("```"):
-            content = content[:-3].strip()
-            
-        return content
+        return _strip_fences(ChatCompletionResponse.model_validate(response).content)
+    except Exception as e:
+        print(f"Failed to generate model output: {e}")
+        return ""
+
+
+async def agenerate_model_output(
+    original_file: str,
+    user_prompt: str,
+    model_name: str,
+    client: Optional["httpx.AsyncClient"] = None
+) -> str:
+    """Async variant of generate_model_output."""
+    try:
+        response = await LLMClient.acall_chat(
+            model=model_name,
+            messages=_code_generation_messages(original_file, user_prompt),
+            temperature=get_settings().code_model_temperature, # Low temp for code
+            max_tokens=2000,
+            client=client
+        )
+        return _strip_fences(ChatCompletionResponse.model_validate(response).content)
     except Exception as e:
         print(f"Failed to generate model output: {e}")
         return ""
+
+
+async def agenerate_model_outputs(
+    jobs: List[Tuple[str, str]],
+    model_name: str,
+    concurrency: Optional[int] = None
+) -> List[str]:
+    """
+    Async variant of generate_model_outputs, for callers already in an event loop.
+
+    Requires httpx.
+    """
+    if httpx is None:
+        raise ImportError("httpx is required for async LLM calls (pip install httpx)")
+    concurrency = max(1, concurrency or get_settings().llm_concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with _new_async_client(concurrency) as client:
+        async def run(original_file: str, user_prompt: str) -> str:
+            async with semaphore:
+                return await agenerate_model_output(original_file, user_prompt, model_name, client=client)
+
+        return await asyncio.gather(*(run(o, p) for o, p in jobs))
+
+
+def generate_model_outputs(
+    jobs: List[Tuple[str, str]],
+    model_name: str,
+    concurrency: Optional[int] = None
+) -> List[str]:
+    """
+    Generate model outputs for many (original_file, user_prompt) pairs.
+
+    Requests are issued concurrently (at most `concurrency` in flight, default
+    `settings.llm_concurrency`) over one shared connection pool. Results are
+    returned in the same order as `jobs`. Falls back to sequential calls when
+    httpx is not installed.
+
+    Runs its own event loop, so it cannot be called from inside one (e.g. a
+    notebook or async code); await agenerate_model_outputs there instead.
+    """
+    if httpx is None:
+        return [generate_model_output(o, p, model_name) for o, p in jobs]
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(agenerate_model_outputs(jobs, model_name, concurrency))
+    raise RuntimeError(
+        "generate_model_outputs() cannot run inside an event loop; "
+        "use `await agenerate_model_outputs(...)` instead"
+    )
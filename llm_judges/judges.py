@@ -1,29 +1,15 @@
+import difflib
 import json
 import requests
-from typing import Optional, Dict, Any
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, List, Tuple, Union
 from .judge_models import JudgeResult
-from config import settings
+from config import get_settings
 
-def build_judge_prompt(original_file: str, user_prompt: str, applied_file: str, target_file: Optional[str] = None) -> str:
-    """
-    Construct the prompt for the LLM judge.
-    """
-    context = ""
-    if target_file:
-        context = f"""
-Reference target file (may be empty if not available):
-<TARGET_FILE>
-{target_file}
-</TARGET_FILE>
-"""
-    else:
-        context = """
-Reference target file (may be empty if not available):
-<TARGET_FILE>
-</TARGET_FILE>
-"""
-
-    prompt = f"""
+# Static judge instructions, built once at import. Only the slots are filled
+# per call (note the doubled braces around the JSON schema example).
+_JUDGE_PREFIX_TEMPLATE = """
 You are an expert code reviewer evaluating an automated code editing system.
 
 You will be given:
@@ -96,7 +82,11 @@ Original file:
 <ORIGINAL_FILE>
 {original_file}
 </ORIGINAL_FILE>
+"""
 
+# Everything after the original file; kept separate so the instructions plus
+# original file form a stable prefix that providers can cache across calls.
+_JUDGE_SUFFIX_TEMPLATE = """
 User request:
 <USER_PROMPT>
 {user_prompt}
@@ -108,10 +98,120 @@ Applied file:
 </APPLIED_FILE>
 {context}
 """
-    return prompt
 
-from tracing import langfuse
-from llm_client import LLMClient
+_TARGET_CONTEXT_TEMPLATE = """
+Reference target file (may be empty if not available):
+<TARGET_FILE>
+{target_file}
+</TARGET_FILE>
+"""
+
+_EMPTY_TARGET_CONTEXT = """
+Reference target file (may be empty if not available):
+<TARGET_FILE>
+</TARGET_FILE>
+"""
+
+
+def build_judge_prompt_parts(
+    original_file: str,
+    user_prompt: str,
+    applied_file: str,
+    target_file: Optional[str] = None
+) -> Tuple[str, str]:
+    """
+    Construct the judge prompt as (prefix, suffix).
+
+    The prefix holds the instructions and the original file, which are shared
+    by every judge call on the same example; the suffix holds the rest.
+    """
+    if target_file:
+        context = _TARGET_CONTEXT_TEMPLATE.format(target_file=target_file)
+    else:
+        context = _EMPTY_TARGET_CONTEXT
+
+    prefix = _JUDGE_PREFIX_TEMPLATE.format(original_file=original_file)
+    suffix = _JUDGE_SUFFIX_TEMPLATE.format(
+        user_prompt=user_prompt,
+        applied_file=applied_file,
+        context=context
+    )
+    return prefix, suffix
+
+
+def build_judge_prompt(original_file: str, user_prompt: str, applied_file: str, target_file: Optional[str] = None) -> str:
+    """
+    Construct the prompt for the LLM judge.
+    """
+    return "".join(build_judge_prompt_parts(original_file, user_prompt, applied_file, target_file))
+
+# Unchanged lines kept around each changed region when compacting large files
+_JUDGE_CONTEXT_LINES = 8
+
+Range = Tuple[int, int]
+
+
+def _change_ranges(a_lines: List[str], b_lines: List[str]) -> Tuple[List[Range], List[Range]]:
+    """Line ranges [start, end) around each changed hunk, in `a_lines` and in `b_lines`."""
+    a_ranges: List[Range] = []
+    b_ranges: List[Range] = []
+    matcher = difflib.SequenceMatcher(None, a_lines, b_lines, autojunk=False)
+    for group in matcher.get_grouped_opcodes(_JUDGE_CONTEXT_LINES):
+        a_ranges.append((group[0][1], group[-1][2]))
+        b_ranges.append((group[0][3], group[-1][4]))
+    return a_ranges, b_ranges
+
+
+def _excerpt(lines: List[str], ranges: List[Range]) -> str:
+    """Join the given line ranges of `lines`, marking each omitted stretch."""
+    out: List[str] = []
+    pos = 0
+    for start, end in sorted(ranges):
+        start = max(start, pos)  # Ranges from two diffs may overlap
+        if end <= start:
+            continue
+        if start > pos:
+            out.append(f"... [{start - pos} unchanged lines omitted] ...")
+        out.extend(lines[start:end])
+        pos = end
+    if pos < len(lines):
+        out.append(f"... [{len(lines) - pos} unchanged lines omitted] ...")
+    return "\n".join(out)
+
+
+def _compact_for_judge(
+    original_file: str,
+    applied_file: str,
+    target_file: Optional[str] = None
+) -> Tuple[str, str, Optional[str]]:
+    """
+    Reduce the judge inputs to the changed regions plus surrounding context.
+
+    Applied and target files are each diffed against the original and only
+    their changed hunks (with _JUDGE_CONTEXT_LINES lines of context) are
+    kept; the original keeps the union of both hunk sets. Omitted stretches
+    are replaced with a marker line so the judge knows code was elided.
+    """
+    original_lines = original_file.splitlines()
+    applied_lines = applied_file.splitlines()
+    original_ranges, applied_ranges = _change_ranges(original_lines, applied_lines)
+
+    compact_target = target_file
+    if target_file:
+        target_lines = target_file.splitlines()
+        target_original_ranges, target_ranges = _change_ranges(original_lines, target_lines)
+        original_ranges += target_original_ranges
+        compact_target = _excerpt(target_lines, target_ranges)
+
+    return (
+        _excerpt(original_lines, original_ranges),
+        _excerpt(applied_lines, applied_ranges),
+        compact_target,
+    )
+
+
+from tracing import langfuse, defer, file_summary
+from llm_client import LLMClient, prompt_with_cached_prefix
 
 def judge_apply_quality(
     original_file: str,
@@ -125,6 +225,7 @@ def judge_apply_quality(
     """
     Use an LLM via OpenRouter to evaluate the quality of the applied change.
     """
+    settings = get_settings()
     model = model_name or settings.judge_models[0] if settings.judge_models else settings.code_model_default
     
     # --- Langfuse Judge Span Start ---
@@ -144,28 +245,35 @@ def judge_apply_quality(
         name="llm_judge",
         as_type="span",
         input={
-            "original_file": original_file,
+            **file_summary("original_file", original_file),
             "user_prompt": user_prompt,
-            "applied_file": applied_file,
-            "target_file": target_file,
+            **file_summary("applied_file", applied_file),
+            **file_summary("target_file", target_file),
             "model_name": model,
         },
     )
     # ---------------------------------
     
-    prompt = build_judge_prompt(
-        original_file=original_file,
+    # Large files are sent as changed regions only; small ones in full
+    prompt_files = (original_file, applied_file, target_file)
+    threshold = settings.judge_inline_threshold_chars
+    if threshold > 0 and len(original_file) > threshold:
+        prompt_files = _compact_for_judge(original_file, applied_file, target_file)
+
+    prompt = prompt_with_cached_prefix(*build_judge_prompt_parts(
+        original_file=prompt_files[0],
         user_prompt=user_prompt,
-        applied_file=applied_file,
-        target_file=target_file
-    )
+        applied_file=prompt_files[1],
+        target_file=prompt_files[2]
+    ))
     
     try:
         # Use the centralized client
         response_json = LLMClient.generate_json(
             model=model,
             prompt=prompt,
-            temperature=settings.llm_temperature
+            temperature=settings.llm_temperature,
+            stream=settings.judge_stream
         )
         
         result = JudgeResult(
@@ -175,8 +283,9 @@ def judge_apply_quality(
             model_name=model
         )
         
-        # --- Langfuse Judge Span Update & Score ---
-        judge_span.update(
+        # --- Langfuse Judge Span Update & Score (deferred off the critical path) ---
+        defer(
+            judge_span.update,
             output={
                 "is_correct": result.is_correct,
                 "score": result.score,
@@ -185,19 +294,21 @@ def judge_apply_quality(
             }
         )
 
-        judge_span.score(
+        defer(
+            judge_span.score,
             name="judge_score",
             value=result.score,
             data_type="NUMERIC",
             comment=result.reason,
         )
-        judge_span.score(
+        defer(
+            judge_span.score,
             name="judge_is_correct",
             value=1 if result.is_correct else 0,
             data_type="BOOLEAN",
             comment="1 if judge considers the change correct",
         )
-        judge_span.end()
+        defer(judge_span.end, end_time=time.time_ns())
         # ------------------------------------------
 
         return result
@@ -206,12 +317,46 @@ def judge_apply_quality(
         error_msg = f"LLM Call Failed: {str(e)}"
         
         # End span with error info
-        judge_span.update(output={"error": error_msg})
-        judge_span.end()
+        defer(judge_span.update, output={"error": error_msg})
+        defer(judge_span.end, end_time=time.time_ns())
         
-        return JudgeResult(
+        # Every field is a known-good literal or str here, so skip validation
+        return JudgeResult.model_construct(
             is_correct=False,
             score=0.0,
             reason=error_msg,
             model_name=model
         )
+
+
+def judge_apply_quality_batch(
+    jobs: List[Dict[str, Any]],
+    max_workers: Optional[int] = None,
+    return_exceptions: bool = False,
+) -> List[Union[JudgeResult, Exception]]:
+    """
+    Run judge_apply_quality for several requests concurrently.
+
+    Each job is a dict of keyword arguments for judge_apply_quality. Calls are
+    I/O-bound, so they are dispatched on a thread pool (at most `max_workers`
+    in flight, default `settings.judge_concurrency`) sharing the pooled HTTP
+    session. Results are returned in the same order as `jobs`.
+
+    If `return_exceptions` is True, an exception raised by a job is placed in
+    its result slot instead of being re-raised.
+    """
+    if not jobs:
+        return []
+    max_workers = max_workers or get_settings().judge_concurrency
+    results: List[Union[JudgeResult, Exception]] = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+        futures = {pool.submit(judge_apply_quality, **job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results[index] = e
+    return results
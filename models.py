@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from enum import Enum
 
@@ -52,3 +52,34 @@ class EvaluationResult(BaseModel):
     judge_reason: Optional[str] = None
     applied_file: str
     error: Optional[str] = None
+
+
+class ChatMessage(BaseModel):
+    """
+    The assistant message inside a chat completion choice.
+    """
+    role: str = "assistant"
+    content: str
+
+
+class ChatChoice(BaseModel):
+    """
+    A single choice in a chat completion response.
+    """
+    message: ChatMessage
+    finish_reason: Optional[str] = None
+
+
+class ChatCompletionResponse(BaseModel):
+    """
+    Minimal schema for an OpenRouter (OpenAI-compatible) chat completion.
+
+    Only the fields the pipeline reads are declared; everything else in the
+    response is ignored.
+    """
+    choices: List[ChatChoice] = Field(min_length=1)
+
+    @property
+    def content(self) -> str:
+        """Content of the first choice's message."""
+        return self.choices[0].message.content
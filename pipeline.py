@@ -5,36 +5,103 @@ This module provides metrics and evaluation utilities for assessing
 the quality of code apply operations.
 """
 
+import argparse
 import ast
+import contextlib
+import functools
+import logging
 import sys
-from typing import List, Tuple, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor
+from logging.handlers import MemoryHandler
+from typing import List, Tuple, Dict, Any, Optional, Sequence, Union
 from dataclasses import dataclass
 from dataset_builder import get_dataset
-from apply_changes import apply_replace_function, extract_function_block
+from apply_changes import APPLY_MODES, extract_function_block
 from models import ModelEdit, DatasetExample, EvaluationResult
 
+logger = logging.getLogger(__name__)
 
-def exact_match(applied: str, target: str) -> bool:
+
+@functools.lru_cache(maxsize=256)
+def _parse(code: str) -> Tuple[Optional[ast.Module], Optional[str]]:
     """
-    Check if the applied code exactly matches the target code (stripped of leading/trailing whitespace).
+    Parse `code` once and return (tree, error_message).
+
+    The metrics below all inspect the same applied/target strings, so caching
+    here turns several parses per example into one. Callers must not mutate
+    the returned tree.
     """
-    return applied.strip() == target.strip()
+    try:
+        return ast.parse(code), None
+    except SyntaxError as e:
+        return None, f"Line {e.lineno}: {e.msg}"
+
+
+@functools.lru_cache(maxsize=256)
+def _lines(code: str) -> Tuple[str, ...]:
+    """`code.splitlines()`, computed once per string and shared by the overlap metrics."""
+    return tuple(code.splitlines())
 
 
-def line_overlap(applied: str, target: str) -> float:
+@dataclass(frozen=True)
+class PreparedExample:
     """
-    Compute a similarity score based on line-by-line comparison.
-    
-    Metric Definition:
-    Intersection of lines at the same position divided by the max length.
-    Score = (Count of indices i where applied_lines[i] == target_lines[i]) / max(len(applied_lines), len(target_lines))
-    
-    This essentially measures how much of the file structure is preserved 
-    and perfectly matching in position.
+    A dataset example with its target-side metric inputs computed once.
+
+    The target file is the same for every code model evaluated on an example,
+    so its stripped text, lines, and AST are derived here instead of inside
+    each metric. The metrics accept a PreparedExample wherever they take a
+    target string. Lines are kept in order because the overlap metrics are
+    positional.
     """
-    a_lines = applied.splitlines()
-    t_lines = target.splitlines()
-    
+    example: DatasetExample
+    target_stripped: str
+    target_lines: Tuple[str, ...]
+    target_normalized_lines: Tuple[str, ...]
+    target_ast: Optional[ast.Module]
+    target_dump: Optional[str]
+    target_node_dumps: Tuple[str, ...]
+
+    @property
+    def target_file(self) -> str:
+        return self.example.target_file
+
+
+Target = Union[str, PreparedExample]
+
+
+def prepare_example(example: DatasetExample) -> PreparedExample:
+    """Parse and split `example.target_file` once for all metrics."""
+    target = example.target_file
+    lines = tuple(target.splitlines())
+    tree, _ = _parse(target)
+    return PreparedExample(
+        example=example,
+        target_stripped=target.strip(),
+        target_lines=lines,
+        target_normalized_lines=tuple(line.strip() for line in lines),
+        target_ast=tree,
+        target_dump=ast.dump(tree) if tree is not None else None,
+        target_node_dumps=tuple(ast.dump(n) for n in ast.iter_child_nodes(tree)) if tree is not None else (),
+    )
+
+
+def prepare_dataset(dataset: List[DatasetExample]) -> List[PreparedExample]:
+    """prepare_example for every example, in order."""
+    return [prepare_example(ex) for ex in dataset]
+
+
+def exact_match(applied: str, target: Target) -> bool:
+    """
+    Check if the applied code exactly matches the target code (stripped of leading/trailing whitespace).
+    """
+    if isinstance(target, PreparedExample):
+        return applied.strip() == target.target_stripped
+    return applied.strip() == target.strip()
+
+
+def _overlap_ratio(a_lines: Sequence[str], t_lines: Sequence[str]) -> float:
+    """Fraction of positions where the two line sequences agree (see line_overlap)."""
     if not a_lines and not t_lines:
         return 1.0  # Both empty
     
@@ -48,6 +115,22 @@ def line_overlap(applied: str, target: str) -> float:
     return same_count / max_len
 
 
+def line_overlap(applied: str, target: Target) -> float:
+    """
+    Compute a similarity score based on line-by-line comparison.
+    
+    Metric Definition:
+    Intersection of lines at the same position divided by the max length.
+    Score = (Count of indices i where applied_lines[i] == target_lines[i]) / max(len(applied_lines), len(target_lines))
+    
+    This essentially measures how much of the file structure is preserved 
+    and perfectly matching in position.
+    """
+    if isinstance(target, PreparedExample):
+        return _overlap_ratio(_lines(applied), target.target_lines)
+    return _overlap_ratio(_lines(applied), _lines(target))
+
+
 def check_syntax_valid(code: str) -> Tuple[bool, Optional[str]]:
     """
     Check if the code is syntactically valid Python.
@@ -55,53 +138,49 @@ def check_syntax_valid(code: str) -> Tuple[bool, Optional[str]]:
     Returns:
         Tuple of (is_valid, error_message)
     """
-    try:
-        ast.parse(code)
-        return True, None
-    except SyntaxError as e:
-        return False, f"Line {e.lineno}: {e.msg}"
+    tree, error = _parse(code)
+    return tree is not None, error
 
 
 def check_function_preserved(applied: str, function_name: str) -> bool:
     """
-    Check if the target function exists in the applied code.
+    Check if the target function exists in the applied code, either at
+    module level or as a method of a top-level class.
     
     This verifies that the apply mechanism correctly placed the function
     and it's parseable.
     """
-    try:
-        tree = ast.parse(applied)
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                if node.name == function_name:
-                    return True
-        return False
-    except SyntaxError:
+    tree, _ = _parse(applied)
+    if tree is None:
         return False
+    # Only module-level functions and methods count as "placed"; there is no
+    # need to descend into function bodies the way ast.walk would.
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == function_name:
+            return True
+        if isinstance(node, ast.ClassDef):
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)) and child.name == function_name:
+                    return True
+    return False
 
 
-def normalized_line_overlap(applied: str, target: str) -> float:
+def normalized_line_overlap(applied: str, target: Target) -> float:
     """
     Compute line overlap after normalizing whitespace.
     
     This is more forgiving than exact line_overlap - it strips each line
     before comparison, so trailing whitespace differences don't matter.
     """
-    a_lines = [line.strip() for line in applied.splitlines()]
-    t_lines = [line.strip() for line in target.splitlines()]
-    
-    if not a_lines and not t_lines:
-        return 1.0
-    
-    max_len = max(len(a_lines), len(t_lines))
-    if max_len == 0:
-        return 0.0
-    
-    same_count = sum(1 for a, t in zip(a_lines, t_lines) if a == t)
-    return same_count / max_len
+    a_lines = [line.strip() for line in _lines(applied)]
+    if isinstance(target, PreparedExample):
+        t_lines = target.target_normalized_lines
+    else:
+        t_lines = [line.strip() for line in _lines(target)]
+    return _overlap_ratio(a_lines, t_lines)
 
 
-def semantic_similarity(applied: str, target: str) -> float:
+def semantic_similarity(applied: str, target: Target) -> float:
     """
     Compute semantic similarity by comparing AST structures.
     
@@ -110,36 +189,38 @@ def semantic_similarity(applied: str, target: str) -> float:
     
     Returns a score from 0.0 to 1.0.
     """
-    try:
-        applied_ast = ast.parse(applied)
-        target_ast = ast.parse(target)
-        
-        # Simple comparison: dump ASTs and compare
-        applied_dump = ast.dump(applied_ast)
-        target_dump = ast.dump(target_ast)
-        
-        if applied_dump == target_dump:
-            return 1.0
-        
-        # Partial credit: compare number of matching top-level nodes
-        applied_nodes = list(ast.iter_child_nodes(applied_ast))
-        target_nodes = list(ast.iter_child_nodes(target_ast))
-        
-        if not target_nodes:
-            return 1.0 if not applied_nodes else 0.0
-        
-        matches = 0
-        for t_node in target_nodes:
-            t_dump = ast.dump(t_node)
-            for a_node in applied_nodes:
-                if ast.dump(a_node) == t_dump:
-                    matches += 1
-                    break
-        
-        return matches / len(target_nodes)
-        
-    except SyntaxError:
+    prepared = target if isinstance(target, PreparedExample) else None
+    if prepared is not None:
+        target = prepared.target_file
+    applied_ast, _ = _parse(applied)
+    target_ast = prepared.target_ast if prepared is not None else _parse(target)[0]
+    if applied_ast is None or target_ast is None:
         return 0.0
+    
+    # Simple comparison: dump ASTs and compare
+    applied_dump = ast.dump(applied_ast)
+    target_dump = prepared.target_dump if prepared is not None else ast.dump(target_ast)
+    
+    if applied_dump == target_dump:
+        return 1.0
+    
+    # Partial credit: compare number of matching top-level nodes
+    applied_nodes = list(ast.iter_child_nodes(applied_ast))
+    if prepared is not None:
+        target_dumps = prepared.target_node_dumps
+    else:
+        target_dumps = [ast.dump(t_node) for t_node in ast.iter_child_nodes(target_ast)]
+    
+    if not target_dumps:
+        return 1.0 if not applied_nodes else 0.0
+    
+    # Dump every node once and test membership by hash instead of re-dumping
+    # applied nodes for each target node. An applied node may match several
+    # identical target nodes, as before.
+    applied_dumps = {ast.dump(a_node) for a_node in applied_nodes}
+    matches = sum(1 for t_dump in target_dumps if t_dump in applied_dumps)
+    
+    return matches / len(target_dumps)
 
 
 @dataclass
@@ -157,6 +238,8 @@ class MetricsSummary:
     by_difficulty: Dict[str, Dict[str, Any]] = None
     
     # By expected outcome
+    expected_success_total: int = 0  # Examples expected to succeed (including skipped ones)
+    expected_failure_total: int = 0  # Examples expected to fail (including skipped ones)
     expected_success_correct: int = 0  # Expected success and got exact match
     expected_failure_correct: int = 0  # Expected failure and didn't get exact match
     
@@ -165,6 +248,51 @@ class MetricsSummary:
             self.by_difficulty = {}
 
 
+def similarity_metrics(applied: str, target: Target, syntax_ok: bool) -> Tuple[bool, float, float, float]:
+    """
+    (exact_match, line_overlap, normalized_overlap, semantic_similarity) for one applied file.
+
+    `syntax_ok` is check_syntax_valid's verdict on `applied`. When the texts
+    are identical (the common case for clean applies) the metrics are not
+    computed: both overlaps are 1.0, and the ASTs match iff the file parses.
+    """
+    target_file = target.target_file if isinstance(target, PreparedExample) else target
+    if applied == target_file:
+        return True, 1.0, 1.0, (1.0 if syntax_ok else 0.0)
+    return (
+        exact_match(applied, target),
+        line_overlap(applied, target),
+        normalized_line_overlap(applied, target),
+        semantic_similarity(applied, target),
+    )
+
+
+def evaluate_all_metrics(
+    applied_file: str,
+    target_file: str,
+    expected_function_name: str
+) -> Dict[str, Any]:
+    """
+    Compute every per-example metric for one applied file.
+
+    Depends only on its string arguments, so it can run in a worker process
+    (see run_pipeline's `workers`). Returns a dict with exact_match,
+    line_overlap, syntax_valid, error, function_preserved,
+    normalized_overlap and semantic_similarity.
+    """
+    syntax_ok, syntax_error = check_syntax_valid(applied_file)
+    is_exact, overlap, norm_overlap, sem_sim = similarity_metrics(applied_file, target_file, syntax_ok)
+    return {
+        "exact_match": is_exact,
+        "line_overlap": overlap,
+        "syntax_valid": syntax_ok,
+        "error": syntax_error,
+        "function_preserved": check_function_preserved(applied_file, expected_function_name),
+        "normalized_overlap": norm_overlap,
+        "semantic_similarity": sem_sim,
+    }
+
+
 def evaluate_single(
     example: DatasetExample,
     applied_file: str
@@ -174,9 +302,8 @@ def evaluate_single(
     
     Returns an EvaluationResult with all metrics.
     """
-    is_exact = exact_match(applied_file, example.target_file)
-    overlap = line_overlap(applied_file, example.target_file)
     syntax_ok, syntax_error = check_syntax_valid(applied_file)
+    is_exact, overlap, _, _ = similarity_metrics(applied_file, example.target_file, syntax_ok)
     func_preserved = check_function_preserved(applied_file, example.expected_function_name)
     
     return EvaluationResult(
@@ -190,25 +317,121 @@ def evaluate_single(
     )
 
 
-def run_pipeline():
-    """Run the basic evaluation pipeline (without LLM judge)."""
+@contextlib.contextmanager
+def _buffered_log_output(capacity: int = 100):
+    """
+    Send log records to stdout in batches of `capacity` while the block runs.
+
+    The handler sits on this module's logger and apply_changes', so progress
+    lines and apply warnings share one buffer and keep their order. Both stop
+    propagating for the duration, so handlers the host process configured on
+    the root logger do not print the same records again. Everything left in
+    the buffer is written when the block exits.
+    """
+    target = logging.StreamHandler(sys.stdout)
+    target.setFormatter(logging.Formatter("%(message)s"))
+    handler = MemoryHandler(capacity, flushLevel=logging.ERROR, target=target)
+    loggers = [logger, logging.getLogger("apply_changes")]
+    previous = [(log, log.propagate) for log in loggers]
+    previous_level = logger.level
+    for log in loggers:
+        log.addHandler(handler)
+        log.propagate = False
+    logger.setLevel(logging.INFO)
+    try:
+        yield
+    finally:
+        for log, propagate in previous:
+            log.removeHandler(handler)
+            log.propagate = propagate
+        logger.setLevel(previous_level)
+        handler.close()  # Flushes the remaining records
+        target.flush()
+
+
+def run_pipeline(workers: int = 1, apply_mode: str = "naive") -> MetricsSummary:
+    """
+    Run the basic evaluation pipeline (without LLM judge).
+
+    With `workers` > 1, all examples are applied first and their metrics are
+    computed in a process pool; apply warnings are then printed up front
+    rather than under each example. `apply_mode` names the apply mechanism
+    (see apply_changes.APPLY_MODES). Returns the summary that was printed.
+    """
+    with _buffered_log_output():
+        return _run_pipeline(workers, apply_mode)
+
+
+def _apply_example(ex: DatasetExample, apply_mode: str = "naive") -> Optional[str]:
+    """Apply the example's predicted code; None if there is nothing to apply."""
+    # Use model_output if available, otherwise fall back to extracting from target
+    if ex.model_output:
+        predicted_code = ex.model_output
+    else:
+        predicted_code = extract_function_block(ex.target_file, ex.expected_function_name)
+    
+    if not predicted_code:
+        return None
+    
+    # Create the edit object
+    edit = ModelEdit(
+        function_name=ex.expected_function_name,
+        new_function_code=predicted_code
+    )
+    
+    # Apply Changes
+    return APPLY_MODES[apply_mode](ex.original_file, edit)
+
+
+def _parallel_metrics(
+    dataset: List[DatasetExample],
+    workers: int,
+    apply_mode: str = "naive"
+) -> Tuple[List[Optional[str]], List[Optional[Dict[str, Any]]]]:
+    """Apply every example, then compute metrics for the applied ones in a process pool."""
+    applied_files = [_apply_example(ex, apply_mode) for ex in dataset]
+    indices = [i for i, applied in enumerate(applied_files) if applied is not None]
+    metrics: List[Optional[Dict[str, Any]]] = [None] * len(dataset)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        computed = pool.map(
+            evaluate_all_metrics,
+            [applied_files[i] for i in indices],
+            [dataset[i].target_file for i in indices],
+            [dataset[i].expected_function_name for i in indices],
+            chunksize=8
+        )
+        for i, m in zip(indices, computed):
+            metrics[i] = m
+    return applied_files, metrics
+
+
+def _run_pipeline(workers: int = 1, apply_mode: str = "naive") -> MetricsSummary:
     dataset = get_dataset()
-    print(f"Running pipeline on {len(dataset)} examples...\n")
+    logger.info(f"Running pipeline on {len(dataset)} examples...\n")
     
     summary = MetricsSummary()
     results: List[EvaluationResult] = []
     
-    for ex in dataset:
-        print(f"--- Example ID: {ex.id} ({ex.expected_function_name}) [{ex.difficulty.value}] ---")
+    if workers > 1:
+        applied_files, precomputed = _parallel_metrics(dataset, workers, apply_mode)
+    
+    for i, ex in enumerate(dataset):
+        logger.info(f"--- Example ID: {ex.id} ({ex.expected_function_name}) [{ex.difficulty.value}] ---")
+        if ex.expected_success:
+            summary.expected_success_total += 1
+        else:
+            summary.expected_failure_total += 1
         
-        # Use model_output if available, otherwise fall back to extracting from target
-        if ex.model_output:
-            predicted_code = ex.model_output
+        if workers > 1:
+            applied_file, metrics = applied_files[i], precomputed[i]
         else:
-            predicted_code = extract_function_block(ex.target_file, ex.expected_function_name)
+            applied_file = _apply_example(ex, apply_mode)
+            metrics = None
+            if applied_file is not None:
+                metrics = evaluate_all_metrics(applied_file, ex.target_file, ex.expected_function_name)
         
-        if not predicted_code:
-            print(f"  [ERROR] No model output and could not extract function '{ex.expected_function_name}'")
+        if applied_file is None:
+            logger.info(f"  [ERROR] No model output and could not extract function '{ex.expected_function_name}'")
             results.append(EvaluationResult(
                 example_id=ex.id,
                 exact_match=False,
@@ -220,17 +443,16 @@ def run_pipeline():
             ))
             continue
         
-        # Create the edit object
-        edit = ModelEdit(
-            function_name=ex.expected_function_name,
-            new_function_code=predicted_code
-        )
-        
-        # Apply Changes
-        applied_file = apply_replace_function(ex.original_file, edit)
-        
         # Evaluate
-        result = evaluate_single(ex, applied_file)
+        result = EvaluationResult(
+            example_id=ex.id,
+            exact_match=metrics["exact_match"],
+            line_overlap=metrics["line_overlap"],
+            syntax_valid=metrics["syntax_valid"],
+            function_preserved=metrics["function_preserved"],
+            applied_file=applied_file,
+            error=metrics["error"]
+        )
         results.append(result)
         
         # Update summary
@@ -242,8 +464,8 @@ def run_pipeline():
         if result.function_preserved:
             summary.function_preserved += 1
         summary.line_overlap_sum += result.line_overlap
-        summary.normalized_overlap_sum += normalized_line_overlap(applied_file, ex.target_file)
-        summary.semantic_similarity_sum += semantic_similarity(applied_file, ex.target_file)
+        summary.normalized_overlap_sum += metrics["normalized_overlap"]
+        summary.semantic_similarity_sum += metrics["semantic_similarity"]
         
         # Track by difficulty
         diff_key = ex.difficulty.value
@@ -267,46 +489,53 @@ def run_pipeline():
         func_status = "✓" if result.function_preserved else "✗"
         expected = "expected" if (ex.expected_success == result.exact_match) else "UNEXPECTED"
         
-        print(f"  {status} | Syntax: {syntax_status} | Func: {func_status} | Overlap: {result.line_overlap:.2f} | {expected}")
+        logger.info(f"  {status} | Syntax: {syntax_status} | Func: {func_status} | Overlap: {result.line_overlap:.2f} | {expected}")
         
         if not result.exact_match and ex.expected_success:
             # Show why it failed when we expected success
             if ex.failure_reason:
-                print(f"  Note: {ex.failure_reason}")
+                logger.info(f"  Note: {ex.failure_reason}")
     
     # Print Summary
-    print("\n" + "=" * 60)
-    print("EVALUATION SUMMARY")
-    print("=" * 60)
+    logger.info("\n" + "=" * 60)
+    logger.info("EVALUATION SUMMARY")
+    logger.info("=" * 60)
     
     total = summary.total
     if total == 0:
-        print("No examples processed.")
-        return
+        logger.info("No examples processed.")
+        return summary
     
-    print(f"\nOverall Results ({total} examples):")
-    print(f"  Exact Matches:      {summary.exact_matches:3d} ({summary.exact_matches/total:6.1%})")
-    print(f"  Syntax Valid:       {summary.syntax_valid:3d} ({summary.syntax_valid/total:6.1%})")
-    print(f"  Function Preserved: {summary.function_preserved:3d} ({summary.function_preserved/total:6.1%})")
-    print(f"  Avg Line Overlap:   {summary.line_overlap_sum/total:.4f}")
-    print(f"  Avg Normalized:     {summary.normalized_overlap_sum/total:.4f}")
-    print(f"  Avg Semantic Sim:   {summary.semantic_similarity_sum/total:.4f}")
+    logger.info(f"\nOverall Results ({total} examples):")
+    logger.info(f"  Exact Matches:      {summary.exact_matches:3d} ({summary.exact_matches/total:6.1%})")
+    logger.info(f"  Syntax Valid:       {summary.syntax_valid:3d} ({summary.syntax_valid/total:6.1%})")
+    logger.info(f"  Function Preserved: {summary.function_preserved:3d} ({summary.function_preserved/total:6.1%})")
+    logger.info(f"  Avg Line Overlap:   {summary.line_overlap_sum/total:.4f}")
+    logger.info(f"  Avg Normalized:     {summary.normalized_overlap_sum/total:.4f}")
+    logger.info(f"  Avg Semantic Sim:   {summary.semantic_similarity_sum/total:.4f}")
     
-    print(f"\nBy Difficulty:")
+    logger.info(f"\nBy Difficulty:")
     for diff, stats in sorted(summary.by_difficulty.items()):
         t = stats["total"]
         e = stats["exact"]
         s = stats["syntax_valid"]
-        print(f"  {diff:12s}: {e}/{t} exact ({e/t:.0%}), {s}/{t} syntax valid")
+        logger.info(f"  {diff:12s}: {e}/{t} exact ({e/t:.0%}), {s}/{t} syntax valid")
     
-    # Count expected outcomes
-    expected_success = len([ex for ex in dataset if ex.expected_success])
-    expected_failure = len([ex for ex in dataset if not ex.expected_success])
-    
-    print(f"\nExpected vs Actual:")
-    print(f"  Expected success, got success: {summary.expected_success_correct}/{expected_success}")
-    print(f"  Expected failure, got failure: {summary.expected_failure_correct}/{expected_failure}")
+    logger.info(f"\nExpected vs Actual:")
+    logger.info(f"  Expected success, got success: {summary.expected_success_correct}/{summary.expected_success_total}")
+    logger.info(f"  Expected failure, got failure: {summary.expected_failure_correct}/{summary.expected_failure_total}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the basic evaluation pipeline (without LLM judge).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for computing metrics (default: 1, in-process)")
+    parser.add_argument("--apply-mode", choices=sorted(APPLY_MODES), default="naive",
+                        help="Apply mechanism: indentation-based (naive, default) or AST line ranges (ast)")
+    args = parser.parse_args()
+    run_pipeline(workers=args.workers, apply_mode=args.apply_mode)
 
 
 if __name__ == "__main__":
-    run_pipeline()
+    main()
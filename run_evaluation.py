@@ -9,23 +9,44 @@ This script runs the full evaluation pipeline including:
 """
 
 import argparse
+import contextlib
 import json
+import logging
+import operator
 import sys
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from dataclasses import dataclass, field
 from datetime import datetime
 
 from dataset_builder import get_dataset, get_dataset_by_difficulty, get_expected_failures
-from apply_changes import apply_replace_function, extract_function_block
+from apply_changes import APPLY_MODES, extract_function_block
 from models import ModelEdit, DatasetExample, EvaluationResult, DifficultyLevel
 from pipeline import (
-    exact_match, line_overlap, check_syntax_valid, 
-    check_function_preserved, normalized_line_overlap, semantic_similarity
+    check_syntax_valid, check_function_preserved, similarity_metrics,
+    PreparedExample, prepare_dataset
 )
-from config import settings
-from llm_judges.judges import judge_apply_quality
-from llm_client import generate_model_output
-from tracing import langfuse
+from config import get_settings
+from llm_judges.judges import judge_apply_quality_batch
+from llm_client import generate_model_outputs
+from tracing import langfuse, defer, drain_deferred, file_summary
+
+# orjson is optional; it writes large result files several times faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# tqdm is optional; without it --quiet runs show no progress bar
+try:
+    from tqdm.auto import tqdm
+except ImportError:
+    tqdm = None
 
 
 @dataclass
@@ -38,7 +59,10 @@ class EvaluationConfig:
     filter_difficulty: Optional[str] = None
     limit: int = 0  # 0 for no limit
     verbose: bool = False
+    quiet: bool = False  # Show a progress bar instead of per-example report blocks
     output_file: Optional[str] = None
+    max_workers: int = 8  # Examples evaluated concurrently per code model
+    apply_mode: str = "naive"  # Apply mechanism, a key of apply_changes.APPLY_MODES
 
 
 @dataclass 
@@ -71,6 +95,495 @@ class DetailedResult:
     outcome_as_expected: bool = False
     failure_reason: Optional[str] = None
 
+    # Full texts, so failed generations can be debugged from the run output
+    # (spans only carry a hash and preview, see tracing.file_summary)
+    model_output: Optional[str] = None
+    applied_file: Optional[str] = None
+
+
+# Report lines of the example being evaluated on the current thread (None outside one)
+_report = threading.local()
+
+# Report output goes through this logger; during run_evaluation a background
+# listener thread does the actual writes to stdout (see _report_logging)
+_report_logger = logging.getLogger(__name__ + ".report")
+_report_logger.propagate = False
+_report_logger.setLevel(logging.INFO)
+
+
+def _print(message: str = "") -> None:
+    """Print a report line, via the background writer when one is running."""
+    if _report_logger.handlers:
+        _report_logger.info(message)
+    else:
+        print(message)
+
+
+class _ReportLogHandler(logging.Handler):
+    """
+    Print log records as part of the report.
+
+    Records emitted while a worker evaluates an example (e.g. apply warnings)
+    go into that example's report block so they stay with it; other records
+    are printed directly.
+    """
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            message = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        lines = getattr(_report, "lines", None)
+        if lines is not None:
+            lines.append(message)
+        else:
+            _print(message)
+
+
+# Project loggers whose warnings go into the report (see _report_logging)
+_REPORTED_LOGGERS = ("apply_changes", "llm_client", "pipeline")
+
+
+@contextlib.contextmanager
+def _report_logging():
+    """
+    Route library warnings into the report for the duration of the block.
+
+    Report lines are queued and written to stdout by a listener thread, so
+    callers never block on terminal or pipe I/O. The queue is drained, in
+    order, before the block exits. The project loggers stop propagating
+    while the block runs, so root handlers the host process configured do
+    not print the same warnings again.
+    """
+    queue: SimpleQueue = SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(queue, stream)
+    queue_handler = QueueHandler(queue)
+    _report_logger.addHandler(queue_handler)
+    listener.start()
+
+    handler = _ReportLogHandler(level=logging.WARNING)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    loggers = [logging.getLogger(name) for name in _REPORTED_LOGGERS]
+    previous = [(log, log.propagate) for log in loggers]
+    for log in loggers:
+        log.addHandler(handler)
+        log.propagate = False
+    try:
+        yield
+    finally:
+        for log, propagate in previous:
+            log.removeHandler(handler)
+            log.propagate = propagate
+        _report_logger.removeHandler(queue_handler)
+        listener.stop()
+
+
+def _apply_succeeded(original_file: str, applied_file: str, model_output: str) -> bool:
+    """
+    Heuristic: the file changed, or the model output is contained in it.
+
+    The containment scan over the whole file only runs once the output's
+    first line has been found, which rejects most misses cheaply.
+    """
+    if applied_file != original_file:
+        return True
+    stripped = model_output.strip()
+    if not stripped:
+        return False
+    first_line = stripped.split("\n", 1)[0]
+    return first_line in applied_file and stripped in applied_file
+
+
+def _evaluate_one(
+    prepared: PreparedExample,
+    code_model: str,
+    config: EvaluationConfig,
+    judge_models: List[str],
+    generated_output: Optional[str] = None
+) -> Tuple[DetailedResult, List[str], bool]:
+    """
+    Evaluate one example against one code model.
+
+    Safe to run on a worker thread: it opens its own Langfuse trace and
+    touches no shared state. Returns (result, report_lines, counted), where
+    report_lines are the lines to print for this example and counted is False
+    when the example was skipped for lack of model output (it is then left
+    out of the aggregate stats).
+    """
+    lines: List[str] = []
+    _report.lines = lines
+    try:
+        result, counted = _evaluate_example(prepared, code_model, config, judge_models, generated_output, lines.append)
+    finally:
+        _report.lines = None
+    return result, lines, counted
+
+
+def _evaluate_example(
+    prepared: PreparedExample,
+    code_model: str,
+    config: EvaluationConfig,
+    judge_models: List[str],
+    generated_output: Optional[str],
+    out: Callable[[str], None]
+) -> Tuple[DetailedResult, bool]:
+    """Body of _evaluate_one; report lines are passed to `out`."""
+    ex = prepared.example
+    out(f"\n--- Example {ex.id}: {ex.expected_function_name} [{ex.difficulty.value}] ---")
+    
+    # --- Langfuse Trace Start ---
+    trace = langfuse.start_span(
+        name="apply_evaluation",
+        input={
+            "id": ex.id,
+            "code_model": code_model,
+            "mode": config.mode,
+            "user_prompt": ex.user_prompt,
+            **file_summary("original_file", ex.original_file),
+            "difficulty": ex.difficulty.value,
+            "expected_success": ex.expected_success,
+        },
+        metadata={
+            "expected_function_name": ex.expected_function_name,
+            "tags": ex.tags,
+        },
+    )
+    
+    # Get model output
+    model_output = ""
+    if config.mode == "real":
+        model_output = generated_output
+        if not model_output:
+             out("  [ERROR] Empty response from model")
+    else:
+        # Simulated mode
+        model_output = ex.model_output
+        if not model_output:
+            # Fallback: extract from target (legacy behavior)
+            model_output = extract_function_block(ex.target_file, ex.expected_function_name)
+            if config.verbose:
+                out(f"  [INFO] No model_output, extracted from target_file")
+    
+    if not model_output:
+        out(f"  [ERROR] No model output available")
+        # Create failure result
+        res = DetailedResult(
+            example_id=ex.id,
+            code_model=code_model,
+            difficulty=ex.difficulty.value,
+            expected_success=ex.expected_success,
+            function_name=ex.expected_function_name,
+            tags=ex.tags,
+            apply_succeeded=False,
+            exact_match=False,
+            line_overlap=0.0,
+            normalized_overlap=0.0,
+            semantic_similarity=0.0,
+            syntax_valid=False,
+            syntax_error="No model output",
+            function_preserved=False,
+            overall_success=False, # Default to False if no model output
+            failure_reason="No model output available",
+            model_output=model_output
+        )
+        defer(trace.end, end_time=time.time_ns())
+        return res, False
+    
+    # Create edit
+    edit = ModelEdit(
+        function_name=ex.expected_function_name,
+        new_function_code=model_output
+    )
+    
+    # --- Apply Span ---
+    apply_span = trace.start_observation(
+        name="apply_change",
+        as_type="span",
+        input={
+            **file_summary("original_file", ex.original_file),
+            "function_name": ex.expected_function_name,
+            **file_summary("model_output", model_output),
+        },
+    )
+    
+    # Apply the change
+    applied_file = APPLY_MODES[config.apply_mode](ex.original_file, edit)
+    
+    # Check if apply actually did something (function was found)
+    apply_succeeded = _apply_succeeded(ex.original_file, applied_file, model_output)
+    
+    # Compute metrics
+    syntax_ok, syntax_err = check_syntax_valid(applied_file)
+    is_exact, overlap, norm_overlap, sem_sim = similarity_metrics(applied_file, prepared, syntax_ok)
+    func_preserved = check_function_preserved(applied_file, ex.expected_function_name)
+    
+    # Primary Success Metric
+    # Success = Applied AND Syntax Valid AND (Exact Match OR High Semantic Similarity)
+    # We use 0.8 as the threshold for semantic similarity
+    overall_success = apply_succeeded and syntax_ok and (is_exact or sem_sim >= 0.8)
+    
+    # Determine if outcome matches expectation
+    outcome_as_expected = (ex.expected_success == is_exact)
+    
+    # Create result
+    result = DetailedResult(
+        example_id=ex.id,
+        code_model=code_model,
+        difficulty=ex.difficulty.value,
+        expected_success=ex.expected_success,
+        function_name=ex.expected_function_name,
+        tags=ex.tags,
+        apply_succeeded=apply_succeeded,
+        exact_match=is_exact,
+        line_overlap=overlap,
+        normalized_overlap=norm_overlap,
+        semantic_similarity=sem_sim,
+        syntax_valid=syntax_ok,
+        syntax_error=syntax_err,
+        function_preserved=func_preserved,
+        overall_success=overall_success,
+        outcome_as_expected=outcome_as_expected,
+        failure_reason=ex.failure_reason if (config.mode == "simulated" and not is_exact) else None,
+        model_output=model_output,
+        applied_file=applied_file
+    )
+    
+    # Log to span (deferred to the tracing thread)
+    defer(apply_span.update, output=file_summary("applied_file", applied_file))
+    defer(apply_span.score, name="exact_match", value=1 if is_exact else 0, data_type="BOOLEAN")
+    defer(apply_span.score, name="line_overlap", value=overlap, data_type="NUMERIC")
+    defer(apply_span.score, name="semantic_similarity", value=sem_sim, data_type="NUMERIC")
+    defer(apply_span.score, name="syntax_valid", value=1 if syntax_ok else 0, data_type="BOOLEAN")
+    defer(apply_span.end, end_time=time.time_ns())
+    
+    # Print result
+    status = "✓" if is_exact else "✗"
+    success_status = "SUCCESS" if overall_success else "FAIL"
+    expected_str = "as expected" if outcome_as_expected else "UNEXPECTED"
+    out(f"  Exact: {status} | Success: {success_status} | SemSim: {sem_sim:.2f} | {expected_str}")
+    
+    # LLM Judge (all judge models for this example run concurrently)
+    judge_results = judge_apply_quality_batch(
+        [
+            dict(
+                original_file=ex.original_file,
+                user_prompt=ex.user_prompt,
+                applied_file=applied_file,
+                target_file=ex.target_file,
+                model_name=model_name,
+                trace=trace,
+                parent_span=apply_span
+            )
+            for model_name in judge_models
+        ],
+        return_exceptions=True
+    )
+    for model_name, judge_result in zip(judge_models, judge_results):
+        if isinstance(judge_result, Exception):
+            out(f"  Judge ({model_name})... Error: {judge_result}")
+            result.judge_scores[model_name] = {"error": str(judge_result)}
+            continue
+
+        out(f"  Judge ({model_name})... Score: {judge_result.score:.2f} | Correct: {judge_result.is_correct}")
+        
+        result.judge_scores[model_name] = {
+            "score": judge_result.score,
+            "is_correct": judge_result.is_correct,
+            "reason": judge_result.reason
+        }
+    
+    defer(trace.end, end_time=time.time_ns())
+    return result, True
+
+
+def _summarize(results: List[DetailedResult], judge_models: List[str]) -> Dict[str, Any]:
+    """
+    Aggregate stats for one code model from its collected results.
+
+    Each stat is reduced in one pass over the results once they are all in,
+    rather than updated field by field as each example finishes.
+    """
+    stats: Dict[str, Any] = {
+        "total": len(results),
+        "exact_matches": sum(r.exact_match for r in results),
+        "syntax_valid": sum(r.syntax_valid for r in results),
+        "function_preserved": sum(r.function_preserved for r in results),
+        "apply_succeeded": sum(r.apply_succeeded for r in results),
+        "overall_success": sum(r.overall_success for r in results),
+        "outcome_as_expected": sum(r.outcome_as_expected for r in results),
+    }
+
+    # By difficulty
+    difficulty_total = Counter(r.difficulty for r in results)
+    difficulty_exact = Counter(r.difficulty for r in results if r.exact_match)
+    difficulty_syntax = Counter(r.difficulty for r in results if r.syntax_valid)
+    stats["by_difficulty"] = {
+        d: {"total": n, "exact": difficulty_exact[d], "syntax": difficulty_syntax[d]}
+        for d, n in difficulty_total.items()
+    }
+
+    # By tag
+    tag_total = Counter(tag for r in results for tag in r.tags)
+    tag_exact = Counter(tag for r in results if r.exact_match for tag in r.tags)
+    stats["by_tag"] = {t: {"total": n, "exact": tag_exact[t]} for t, n in tag_total.items()}
+
+    # Judge scores (failed judge calls are not counted)
+    stats["judge_scores"] = {}
+    for model in judge_models:
+        scores = [
+            r.judge_scores[model] for r in results
+            if model in r.judge_scores and "error" not in r.judge_scores[model]
+        ]
+        stats["judge_scores"][model] = {
+            "sum": sum((s["score"] for s in scores), 0.0),
+            "correct": sum(1 for s in scores if s["is_correct"]),
+            "count": len(scores),
+        }
+    return stats
+
+
+def _evaluate_model(
+    code_model: str,
+    dataset: List[PreparedExample],
+    config: EvaluationConfig,
+    judge_models: List[str],
+    out: Callable[[str], None] = _print,
+    on_result: Optional[Callable[[DetailedResult], None]] = None
+) -> List[DetailedResult]:
+    """
+    Evaluate every prepared example against one code model and report a summary.
+
+    Report lines are passed to `out`, so several models can be evaluated on
+    separate threads and their reports printed one after another. Each result
+    is also passed to `on_result`, if given, as soon as it is available.
+    """
+    out(f"\n" + "=" * 80)
+    out(f"EVALUATING CODE MODEL: {code_model}")
+    out("=" * 80)
+
+    current_model_results = []
+    counted_results = []  # Examples skipped for lack of model output are left out of the stats
+
+    # Real mode: request all generations up front so they run concurrently
+    generated_outputs: List[Optional[str]] = [None] * len(dataset)
+    if config.mode == "real":
+        out(f"Generating code with {code_model} for {len(dataset)} examples...")
+        generated_outputs = generate_model_outputs(
+            [(p.example.original_file, p.example.user_prompt) for p in dataset], code_model
+        )
+
+    progress = None
+    if config.quiet and tqdm is not None:
+        progress = tqdm(total=len(dataset), desc=code_model)
+    exact_so_far = success_so_far = 0
+
+    # Examples run concurrently; each report block is printed whole, in dataset order
+    with ThreadPoolExecutor(max_workers=max(1, config.max_workers)) as pool:
+        outcomes = pool.map(
+            lambda i: _evaluate_one(dataset[i], code_model, config, judge_models, generated_outputs[i]),
+            range(len(dataset))
+        )
+        for result, report, counted in outcomes:
+            if not config.quiet:
+                out("\n".join(report))
+            if counted:
+                counted_results.append(result)
+                exact_so_far += result.exact_match
+                success_so_far += result.overall_success
+            current_model_results.append(result)
+            if on_result is not None:
+                on_result(result)
+            if progress is not None:
+                total_so_far = len(counted_results)
+                progress.set_postfix(
+                    exact=f"{exact_so_far}/{total_so_far}",
+                    success=f"{success_so_far}/{total_so_far}",
+                    refresh=False
+                )
+                progress.update(1)
+    if progress is not None:
+        progress.close()
+
+    stats = _summarize(counted_results, judge_models)
+
+    # Print Summary for this model
+    out("\n" + "-" * 70)
+    out(f"SUMMARY FOR MODEL: {code_model}")
+    out("-" * 70)
+
+    total = stats["total"]
+    if total == 0:
+        out("No examples processed.")
+    else:
+        out(f"\n📊 Overall Results ({total} examples)")
+        out(f"   Exact Matches:      {stats['exact_matches']:3d} ({stats['exact_matches']/total:6.1%})")
+        out(f"   Overall Success:    {stats['overall_success']:3d} ({stats['overall_success']/total:6.1%})")
+        out(f"   Apply Succeeded:    {stats['apply_succeeded']:3d} ({stats['apply_succeeded']/total:6.1%})")
+        out(f"   Syntax Valid:       {stats['syntax_valid']:3d} ({stats['syntax_valid']/total:6.1%})")
+        out(f"   Function Preserved: {stats['function_preserved']:3d} ({stats['function_preserved']/total:6.1%})")
+        out(f"   Outcome as Expected:{stats['outcome_as_expected']:3d} ({stats['outcome_as_expected']/total:6.1%})")
+
+        if judge_models:
+            out(f"   Judge Results:")
+            for model, s in stats["judge_scores"].items():
+                if s["count"] > 0:
+                    out(f"     {model}: Avg {s['sum']/s['count']:.2f}, Correct {s['correct']}/{s['count']}")
+    
+    return current_model_results
+
+
+# DetailedResult fields saved to the output file, in output order
+_RECORD_FIELDS = (
+    "example_id",
+    "code_model",
+    "difficulty",
+    "function_name",
+    "exact_match",
+    "overall_success",
+    "syntax_valid",
+    "line_overlap",
+    "semantic_similarity",
+    "judge_scores",
+    "model_output",
+    "applied_file",
+)
+_get_record_fields = operator.attrgetter(*_RECORD_FIELDS)
+
+
+def _result_record(r: DetailedResult) -> Dict[str, Any]:
+    """The fields of a result that are saved to the output file."""
+    return dict(zip(_RECORD_FIELDS, _get_record_fields(r)))
+
+
+@contextlib.contextmanager
+def _jsonl_results(path: Optional[str], run_info: Dict[str, Any]):
+    """
+    Yield a callback that appends each result to `path` as one JSON line.
+
+    Used when the output file ends in ".jsonl": rows are written as they are
+    produced, so nothing is lost if a long run dies part way, and the run
+    metadata goes to a "<name>.config.json" sidecar. Yields None otherwise.
+    """
+    if not path or not path.endswith(".jsonl"):
+        yield None
+        return
+    with open(path[:-len(".jsonl")] + ".config.json", "w") as f:
+        json.dump(run_info, f, indent=2)
+    lock = threading.Lock()
+    with open(path, "wb", buffering=1024 * 1024) as f:
+        def write(result: DetailedResult) -> None:
+            record = _result_record(result)
+            if orjson is not None:
+                line = orjson.dumps(record) + b"\n"
+            else:
+                # Same compact form as orjson, so output does not depend on which is installed
+                line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            with lock:  # Several code models may report at once
+                f.write(line)
+        yield write
+
 
 def run_evaluation(config: EvaluationConfig) -> List[DetailedResult]:
     """
@@ -78,6 +591,13 @@ def run_evaluation(config: EvaluationConfig) -> List[DetailedResult]:
     
     Returns a list of DetailedResult objects for analysis.
     """
+    with _report_logging():
+        return _run_evaluation(config)
+
+
+def _run_evaluation(config: EvaluationConfig) -> List[DetailedResult]:
+    settings = get_settings()
+
     # Load dataset
     dataset = get_dataset()
     
@@ -87,14 +607,16 @@ def run_evaluation(config: EvaluationConfig) -> List[DetailedResult]:
             diff = DifficultyLevel(config.filter_difficulty)
             dataset = get_dataset_by_difficulty(diff)
         except ValueError:
-            print(f"Warning: Unknown difficulty '{config.filter_difficulty}', using full dataset")
+            _print(f"Warning: Unknown difficulty '{config.filter_difficulty}', using full dataset")
     
     # Apply limit
     if config.limit > 0:
         dataset = dataset[:config.limit]
     
-    print(f"Running evaluation on {len(dataset)} examples...")
-    print(f"Mode: {config.mode.upper()}")
+    _print(f"Running evaluation on {len(dataset)} examples...")
+    _print(f"Mode: {config.mode.upper()}")
+    if config.apply_mode != "naive":
+        _print(f"Apply mode: {config.apply_mode}")
     
     # Determine code models to run
     code_models_to_test = config.code_models
@@ -104,7 +626,7 @@ def run_evaluation(config: EvaluationConfig) -> List[DetailedResult]:
         else:
             code_models_to_test = ["simulated"]
             
-    print(f"Code Models: {code_models_to_test}")
+    _print(f"Code Models: {code_models_to_test}")
     
     # Setup judge models
     judge_models = []
@@ -112,291 +634,56 @@ def run_evaluation(config: EvaluationConfig) -> List[DetailedResult]:
         judge_models = config.judge_models if config.judge_models else settings.judge_models
         if not judge_models:
             judge_models = [settings.code_model_default]
-        print(f"LLM Judges enabled: {judge_models}")
+        _print(f"LLM Judges enabled: {judge_models}")
     
     all_results: List[DetailedResult] = []
+    # Target files are shared by every code model; parse and split them once
+    prepared = prepare_dataset(dataset)
+    run_info = {
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "mode": config.mode,
+            "code_models": code_models_to_test,
+            "use_llm_judge": config.use_llm_judge,
+            "judge_models": judge_models,
+            "apply_mode": config.apply_mode,
+        },
+    }
     
-    # Outer loop: Iterate over Code Models
-    for code_model in code_models_to_test:
-        print(f"\n" + "=" * 80)
-        print(f"EVALUATING CODE MODEL: {code_model}")
-        print("=" * 80)
-    
-        # Aggregate stats for this model
-        stats = {
-            "total": 0,
-            "exact_matches": 0,
-            "syntax_valid": 0,
-            "function_preserved": 0,
-            "apply_succeeded": 0,
-            "overall_success": 0,
-            "outcome_as_expected": 0,
-            "by_difficulty": {},
-            "by_tag": {},
-            "judge_scores": {m: {"sum": 0.0, "correct": 0, "count": 0} for m in judge_models}
-        }
-        
-        current_model_results = []
-    
-        for ex in dataset:
-            print(f"\n--- Example {ex.id}: {ex.expected_function_name} [{ex.difficulty.value}] ---")
-            
-            # --- Langfuse Trace Start ---
-            trace = langfuse.start_span(
-                name="apply_evaluation",
-                input={
-                    "id": ex.id,
-                    "code_model": code_model,
-                    "mode": config.mode,
-                    "user_prompt": ex.user_prompt,
-                    "original_file": ex.original_file,
-                    "difficulty": ex.difficulty.value,
-                    "expected_success": ex.expected_success,
-                },
-                metadata={
-                    "expected_function_name": ex.expected_function_name,
-                    "tags": ex.tags,
-                },
-            )
-            
-            # Get model output
-            model_output = ""
-            if config.mode == "real":
-                print(f"  Generating code with {code_model}...")
-                model_output = generate_model_output(ex.original_file, ex.user_prompt, code_model)
-                if not model_output:
-                     print("  [ERROR] Empty response from model")
-            else:
-                # Simulated mode
-                model_output = ex.model_output
-                if not model_output:
-                    # Fallback: extract from target (legacy behavior)
-                    model_output = extract_function_block(ex.target_file, ex.expected_function_name)
-                    if config.verbose:
-                        print(f"  [INFO] No model_output, extracted from target_file")
-            
-            if not model_output:
-                print(f"  [ERROR] No model output available")
-                # Create failure result
-                res = DetailedResult(
-                    example_id=ex.id,
-                    code_model=code_model,
-                    difficulty=ex.difficulty.value,
-                    expected_success=ex.expected_success,
-                    function_name=ex.expected_function_name,
-                    tags=ex.tags,
-                    apply_succeeded=False,
-                    exact_match=False,
-                    line_overlap=0.0,
-                    normalized_overlap=0.0,
-                    semantic_similarity=0.0,
-                    syntax_valid=False,
-                    syntax_error="No model output",
-                    function_preserved=False,
-                    overall_success=False, # Default to False if no model output
-                    failure_reason="No model output available"
-                )
-                current_model_results.append(res)
-                all_results.append(res)
-                trace.end()
-                continue
-            
-            # Create edit
-            edit = ModelEdit(
-                function_name=ex.expected_function_name,
-                new_function_code=model_output
-            )
-            
-            # --- Apply Span ---
-            apply_span = trace.start_observation(
-                name="apply_change",
-                as_type="span",
-                input={
-                    "original_file": ex.original_file,
-                    "function_name": ex.expected_function_name,
-                    "model_output": model_output,
-                },
-            )
-            
-            # Apply the change
-            applied_file = apply_replace_function(ex.original_file, edit)
-            
-            # Check if apply actually did something (function was found)
-            # Heuristic: file changed OR model output is contained
-            apply_succeeded = applied_file != ex.original_file or (model_output.strip() and model_output.strip() in applied_file)
-            
-            # Compute metrics
-            is_exact = exact_match(applied_file, ex.target_file)
-            overlap = line_overlap(applied_file, ex.target_file)
-            norm_overlap = normalized_line_overlap(applied_file, ex.target_file)
-            sem_sim = semantic_similarity(applied_file, ex.target_file)
-            syntax_ok, syntax_err = check_syntax_valid(applied_file)
-            func_preserved = check_function_preserved(applied_file, ex.expected_function_name)
-            
-            # Primary Success Metric
-            # Success = Applied AND Syntax Valid AND (Exact Match OR High Semantic Similarity)
-            # We use 0.8 as the threshold for semantic similarity
-            overall_success = apply_succeeded and syntax_ok and (is_exact or sem_sim >= 0.8)
-            
-            # Determine if outcome matches expectation
-            outcome_as_expected = (ex.expected_success == is_exact)
-            
-            # Create result
-            result = DetailedResult(
-                example_id=ex.id,
-                code_model=code_model,
-                difficulty=ex.difficulty.value,
-                expected_success=ex.expected_success,
-                function_name=ex.expected_function_name,
-                tags=ex.tags,
-                apply_succeeded=apply_succeeded,
-                exact_match=is_exact,
-                line_overlap=overlap,
-                normalized_overlap=norm_overlap,
-                semantic_similarity=sem_sim,
-                syntax_valid=syntax_ok,
-                syntax_error=syntax_err,
-                function_preserved=func_preserved,
-                overall_success=overall_success,
-                outcome_as_expected=outcome_as_expected,
-                failure_reason=ex.failure_reason if (config.mode == "simulated" and not is_exact) else None
+    with _jsonl_results(config.output_file, run_info) as on_result:
+        if len(code_models_to_test) == 1:
+            all_results = _evaluate_model(
+                code_models_to_test[0], prepared, config, judge_models, on_result=on_result
             )
-            
-            # Update stats
-            stats["total"] += 1
-            if is_exact:
-                stats["exact_matches"] += 1
-            if syntax_ok:
-                stats["syntax_valid"] += 1
-            if func_preserved:
-                stats["function_preserved"] += 1
-            if apply_succeeded:
-                stats["apply_succeeded"] += 1
-            if overall_success:
-                stats["overall_success"] += 1
-            if outcome_as_expected:
-                stats["outcome_as_expected"] += 1
-            
-            # By difficulty
-            diff_key = ex.difficulty.value
-            if diff_key not in stats["by_difficulty"]:
-                stats["by_difficulty"][diff_key] = {"total": 0, "exact": 0, "syntax": 0}
-            stats["by_difficulty"][diff_key]["total"] += 1
-            if is_exact:
-                stats["by_difficulty"][diff_key]["exact"] += 1
-            if syntax_ok:
-                stats["by_difficulty"][diff_key]["syntax"] += 1
-            
-            # By tag
-            for tag in ex.tags:
-                if tag not in stats["by_tag"]:
-                    stats["by_tag"][tag] = {"total": 0, "exact": 0}
-                stats["by_tag"][tag]["total"] += 1
-                if is_exact:
-                    stats["by_tag"][tag]["exact"] += 1
-            
-            # Log to span
-            apply_span.update(output={"applied_file": applied_file})
-            apply_span.score(name="exact_match", value=1 if is_exact else 0, data_type="BOOLEAN")
-            apply_span.score(name="line_overlap", value=overlap, data_type="NUMERIC")
-            apply_span.score(name="semantic_similarity", value=sem_sim, data_type="NUMERIC")
-            apply_span.score(name="syntax_valid", value=1 if syntax_ok else 0, data_type="BOOLEAN")
-            apply_span.end()
-            
-            # Print result
-            status = "✓" if is_exact else "✗"
-            success_status = "SUCCESS" if overall_success else "FAIL"
-            expected_str = "as expected" if outcome_as_expected else "UNEXPECTED"
-            print(f"  Exact: {status} | Success: {success_status} | SemSim: {sem_sim:.2f} | {expected_str}")
-            
-            # LLM Judge
-            for model_name in judge_models:
-                print(f"  Judge ({model_name})... ", end="", flush=True)
-                try:
-                    judge_result = judge_apply_quality(
-                        original_file=ex.original_file,
-                        user_prompt=ex.user_prompt,
-                        applied_file=applied_file,
-                        target_file=ex.target_file,
-                        model_name=model_name,
-                        trace=trace,
-                        parent_span=apply_span
-                    )
-                    print(f"Score: {judge_result.score:.2f} | Correct: {judge_result.is_correct}")
-                    
-                    result.judge_scores[model_name] = {
-                        "score": judge_result.score,
-                        "is_correct": judge_result.is_correct,
-                        "reason": judge_result.reason
-                    }
-                    
-                    stats["judge_scores"][model_name]["sum"] += judge_result.score
-                    stats["judge_scores"][model_name]["count"] += 1
-                    if judge_result.is_correct:
-                        stats["judge_scores"][model_name]["correct"] += 1
-                        
-                except Exception as e:
-                    print(f"Error: {e}")
-                    result.judge_scores[model_name] = {"error": str(e)}
-            
-            current_model_results.append(result)
-            all_results.append(result)
-            trace.end()
-        
-        # --- End of Code Model Loop ---
-        # Print Summary for this model
-        print("\n" + "-" * 70)
-        print(f"SUMMARY FOR MODEL: {code_model}")
-        print("-" * 70)
-        
-        total = stats["total"]
-        if total == 0:
-            print("No examples processed.")
         else:
-            print(f"\n📊 Overall Results ({total} examples)")
-            print(f"   Exact Matches:      {stats['exact_matches']:3d} ({stats['exact_matches']/total:6.1%})")
-            print(f"   Overall Success:    {stats['overall_success']:3d} ({stats['overall_success']/total:6.1%})")
-            print(f"   Apply Succeeded:    {stats['apply_succeeded']:3d} ({stats['apply_succeeded']/total:6.1%})")
-            print(f"   Syntax Valid:       {stats['syntax_valid']:3d} ({stats['syntax_valid']/total:6.1%})")
-            print(f"   Function Preserved: {stats['function_preserved']:3d} ({stats['function_preserved']/total:6.1%})")
-            print(f"   Outcome as Expected:{stats['outcome_as_expected']:3d} ({stats['outcome_as_expected']/total:6.1%})")
-    
-            if judge_models:
-                print(f"   Judge Results:")
-                for model, s in stats["judge_scores"].items():
-                    if s["count"] > 0:
-                        print(f"     {model}: Avg {s['sum']/s['count']:.2f}, Correct {s['correct']}/{s['count']}")
-
-    # Save results if output file specified (using all results)
+            # Code models run concurrently; each model's report is printed whole, in order
+            reports: List[List[str]] = [[] for _ in code_models_to_test]
+            with ThreadPoolExecutor(max_workers=len(code_models_to_test)) as pool:
+                futures = [
+                    pool.submit(_evaluate_model, code_model, prepared, config, judge_models, report.append, on_result)
+                    for code_model, report in zip(code_models_to_test, reports)
+                ]
+                for report, future in zip(reports, futures):
+                    model_results = future.result()
+                    _print("\n".join(report))
+                    all_results.extend(model_results)
+    
+    # Save results if output file specified (JSONL output was written as it ran)
     if config.output_file:
-        output_data = {
-            "timestamp": datetime.now().isoformat(),
-            "config": {
-                "mode": config.mode,
-                "code_models": code_models_to_test,
-                "use_llm_judge": config.use_llm_judge,
-                "judge_models": judge_models,
-            },
-            "results": [
-                {
-                    "example_id": r.example_id,
-                    "code_model": r.code_model,
-                    "difficulty": r.difficulty,
-                    "function_name": r.function_name,
-                    "exact_match": r.exact_match,
-                    "overall_success": r.overall_success,
-                    "syntax_valid": r.syntax_valid,
-                    "line_overlap": r.line_overlap,
-                    "semantic_similarity": r.semantic_similarity,
-                    "judge_scores": r.judge_scores,
-                }
-                for r in all_results
-            ]
-        }
-        with open(config.output_file, 'w') as f:
-            json.dump(output_data, f, indent=2)
-        print(f"\n📁 Results saved to {config.output_file}")
+        if on_result is None:
+            output_data = {
+                **run_info,
+                "results": [_result_record(r) for r in all_results],
+            }
+            if orjson is not None:
+                with open(config.output_file, 'wb') as f:
+                    f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
+            else:
+                with open(config.output_file, 'w') as f:
+                    json.dump(output_data, f, indent=2)
+        _print(f"\n📁 Results saved to {config.output_file}")
     
+    drain_deferred()
     langfuse.flush()
     return all_results
 
@@ -411,6 +698,8 @@ Examples:
   python run_evaluation.py --use-llm-judge    # With LLM judge
   python run_evaluation.py --difficulty hard  # Only hard examples
   python run_evaluation.py -o results.json    # Save results to file
+  python run_evaluation.py -o results.jsonl   # Stream results, one JSON line each
+  python run_evaluation.py --quiet            # Progress bar and summaries only
         """
     )
     parser.add_argument("--mode", type=str, default="simulated",
@@ -431,15 +720,26 @@ Examples:
                         help="Filter examples by difficulty level")
     parser.add_argument("--verbose", "-v", action="store_true",
                         help="Verbose output")
+    parser.add_argument("--quiet", "-q", action="store_true",
+                        help="Skip per-example output; show a progress bar (if tqdm is installed) and summaries")
     parser.add_argument("--output", "-o", type=str,
-                        help="Save results to JSON file")
+                        help="Save results to a JSON file, or stream them to a .jsonl file")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="Ignore cached LLM responses (fresh ones are still stored)")
+    parser.add_argument("--max-workers", type=int, default=8,
+                        help="Examples to evaluate concurrently per code model (default: 8)")
+    parser.add_argument("--apply-mode", choices=sorted(APPLY_MODES), default="naive",
+                        help="Apply mechanism: indentation-based (naive, default) or AST line ranges (ast)")
     
     args = parser.parse_args()
     
+    if args.refresh_cache:
+        get_settings().llm_cache_refresh = True
+    
     # Build config
     judge_models = []
     if args.all_judge_models:
-        judge_models = settings.judge_models
+        judge_models = get_settings().judge_models
     elif args.judge_model:
         judge_models = args.judge_model
     
@@ -454,7 +754,10 @@ Examples:
         filter_difficulty=args.difficulty,
         limit=args.limit,
         verbose=args.verbose,
-        output_file=args.output
+        quiet=args.quiet,
+        output_file=args.output,
+        max_workers=args.max_workers,
+        apply_mode=args.apply_mode
     )
     
     run_evaluation(config)
@@ -1,83 +1,170 @@
+import atexit
+import hashlib
 import os
-from typing import Optional, Any
+import queue
+import threading
+import time
+from typing import Optional, Any, Callable, Dict
 
-# Try to import Langfuse, provide None if missing
-try:
-    from langfuse import Langfuse
-except ImportError:
-    Langfuse = None
+from config import load_env
 
-# Load environment variables
+# Load environment variables (including any kept only in .env)
+load_env()
 LANGFUSE_PUBLIC_KEY = os.getenv("LANGFUSE_PUBLIC_KEY")
 LANGFUSE_SECRET_KEY = os.getenv("LANGFUSE_SECRET_KEY")
 LANGFUSE_BASE_URL = os.getenv("LANGFUSE_BASE_URL")
+# Set LANGFUSE_ENABLED=false to skip tracing even when keys are configured
+LANGFUSE_ENABLED = os.getenv("LANGFUSE_ENABLED", "true").strip().lower() not in ("0", "false", "no", "off")
+# Export spans in batches instead of one request per span
+LANGFUSE_FLUSH_AT = int(os.getenv("LANGFUSE_FLUSH_AT", "100"))
+LANGFUSE_FLUSH_INTERVAL = float(os.getenv("LANGFUSE_FLUSH_INTERVAL", "5.0"))
+# Characters of each file kept in span payloads (see file_summary)
+LANGFUSE_PREVIEW_CHARS = int(os.getenv("LANGFUSE_PREVIEW_CHARS", "500"))
+# Set LANGFUSE_FULL_TEXT=true to also send whole files in span payloads
+LANGFUSE_FULL_TEXT = os.getenv("LANGFUSE_FULL_TEXT", "false").strip().lower() in ("1", "true", "yes", "on")
 
 class NoOpSpan:
     """A no-op span that ignores all calls."""
-    def span(self, *args, **kwargs) -> 'NoOpSpan':
+    def _noop(self, *args, **kwargs) -> 'NoOpSpan':
         return self
 
-    def start_span(self, *args, **kwargs) -> 'NoOpSpan':
-        return self
-
-    def start_observation(self, *args, **kwargs) -> 'NoOpSpan':
-        return self
-
-    def update(self, *args, **kwargs) -> 'NoOpSpan':
-        return self
+    # One shared function under every span method name; plain class
+    # attributes, so lookups stay on the fast path
+    span = start_span = start_observation = _noop
+    update = score = score_trace = end = event = generation = _noop
 
-    def score(self, *args, **kwargs) -> 'NoOpSpan':
-        return self
-        
-    def score_trace(self, *args, **kwargs) -> 'NoOpSpan':
-        return self
+    def __getattr__(self, name: str):
+        # Any other span method the SDK offers is a no-op too
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self._noop
 
-    def end(self, *args, **kwargs) -> 'NoOpSpan':
-        return self
-        
-    def event(self, *args, **kwargs) -> 'NoOpSpan':
-        return self
-        
-    def generation(self, *args, **kwargs) -> 'NoOpSpan':
-        return self
+# No-op spans hold no state, so one instance serves every caller
+_NOOP_SPAN = NoOpSpan()
 
 class NoOpLangfuse:
     """A no-op Langfuse client that returns no-op spans."""
-    def trace(self, *args, **kwargs) -> NoOpSpan:
-        return NoOpSpan()
+    def _new_span(self, *args, **kwargs) -> NoOpSpan:
+        return _NOOP_SPAN
 
-    def span(self, *args, **kwargs) -> NoOpSpan:
-        return NoOpSpan()
+    trace = span = start_span = start_observation = _new_span
 
-    def start_span(self, *args, **kwargs) -> NoOpSpan:
-        return NoOpSpan()
-
-    def start_observation(self, *args, **kwargs) -> NoOpSpan:
-        return NoOpSpan()
-        
     def score(self, *args, **kwargs) -> Any:
         return None
-        
+
     def flush(self, *args, **kwargs) -> None:
         pass
 
-# Initialize Langfuse or fallback to NoOp
-if Langfuse and LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY:
+def _load_langfuse():
+    """Import the Langfuse SDK, or return None if it is not installed."""
+    try:
+        from langfuse import Langfuse
+    except ImportError:
+        return None
+    return Langfuse
+
+
+# Initialize Langfuse or fallback to NoOp. The SDK (and its OpenTelemetry
+# setup) is only imported when tracing is enabled and configured, which keeps
+# untraced runs such as simulated CI evaluations fast to start.
+Langfuse = None
+if LANGFUSE_ENABLED and LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY:
+    Langfuse = _load_langfuse()
+if Langfuse is not None:
     try:
         langfuse = Langfuse(
             public_key=LANGFUSE_PUBLIC_KEY,
             secret_key=LANGFUSE_SECRET_KEY,
             base_url=LANGFUSE_BASE_URL,
+            flush_at=LANGFUSE_FLUSH_AT,
+            flush_interval=LANGFUSE_FLUSH_INTERVAL,
         )
     except Exception as e:
         print(f"Warning: Failed to initialize Langfuse: {e}")
         langfuse = NoOpLangfuse()
 else:
-    # If dependencies missing or keys not set, use NoOp
-    if Langfuse is None:
-        pass # specific warning if import failed could be added if desired, but silent fallback is often preferred
-    elif not (LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY):
-        # Only warn if it looks like they might have wanted it but missed keys? 
-        # Or just stay silent to avoid noise in non-instrumented envs.
-        pass
+    # If disabled, keys not set, or dependencies missing, use NoOp
+    # (silent fallback to avoid noise in non-instrumented envs)
     langfuse = NoOpLangfuse()
+
+
+def file_summary(name: str, text: Optional[str]) -> Dict[str, Any]:
+    """
+    Identify a file in a span payload by hash and short preview instead of full text.
+
+    Span payloads are queued in memory and exported for every example, so
+    whole files make them grow with file size. The SHA-256 still lets
+    identical files be matched across traces. Full texts are not lost:
+    original and target files are in the dataset, and run_evaluation saves
+    each model output and applied file in its results file (`-o`). With
+    LANGFUSE_FULL_TEXT set, the whole text is sent under `name` as well,
+    e.g. to recover the full files behind a judge verdict.
+    """
+    if text is None:
+        return {name: None}
+    summary = {
+        f"{name}_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        f"{name}_chars": len(text),
+        f"{name}_preview": text[:LANGFUSE_PREVIEW_CHARS],
+    }
+    if LANGFUSE_FULL_TEXT:
+        summary[name] = text
+    return summary
+
+
+# --- Deferred Langfuse calls ---
+# Span updates, scores and ends are queued and executed by one background
+# thread, so network round-trips to Langfuse stay off the caller's critical
+# path. A single worker keeps the calls in submission order.
+_deferred: "queue.Queue" = queue.Queue()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+
+def _run_deferred() -> None:
+    while True:
+        fn, args, kwargs = _deferred.get()
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            print(f"Warning: Deferred Langfuse call failed: {e}")
+        finally:
+            _deferred.task_done()
+
+
+def defer(fn: Callable[..., Any], *args, **kwargs) -> None:
+    """
+    Queue a Langfuse call (e.g. `span.update`) to run on the background thread.
+
+    With the no-op client the call is made inline, since there is no I/O to hide.
+    When deferring `span.end`, pass `end_time=time.time_ns()` so the span
+    ends when the work did, not when the background thread reaches it.
+    """
+    global _worker
+    if isinstance(langfuse, NoOpLangfuse):
+        fn(*args, **kwargs)
+        return
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_run_deferred, name="langfuse-deferred", daemon=True)
+                _worker.start()
+    _deferred.put((fn, args, kwargs))
+
+
+def drain_deferred(timeout: float = 10.0) -> bool:
+    """
+    Wait up to `timeout` seconds for queued Langfuse calls to finish.
+
+    Call before `langfuse.flush()` so the flush includes them. Also runs at
+    interpreter exit. Returns False if calls were still pending at the deadline.
+    """
+    deadline = time.monotonic() + timeout
+    while _deferred.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+atexit.register(drain_deferred)